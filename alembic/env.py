@@ -1,11 +1,13 @@
 from logging.config import fileConfig
 
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
 from sqlalchemy.pool import NullPool
 
 from alembic import context
 
 from app.config import DATABASE_URL_SYNC
+from app.db.engine import set_sqlite_pragmas
 
 # this is the Alembic Config object, which provides
 # access to the values within the .ini file in use.
@@ -24,6 +26,9 @@ from app.db.models import *
 
 target_metadata = Base.metadata
 
+# SQLite can't alter most of a table in place, batch mode recreates the table instead
+is_sqlite = make_url(DATABASE_URL_SYNC).get_backend_name() == 'sqlite'
+
 # other values from the config, defined by the needs of env.py,
 # can be acquired:
 # my_important_option = config.get_main_option("my_important_option")
@@ -48,6 +53,7 @@ def run_migrations_offline() -> None:
         target_metadata=target_metadata,
         literal_binds=True,
         dialect_opts={"paramstyle": "named"},
+        render_as_batch=is_sqlite,
     )
 
     with context.begin_transaction():
@@ -65,10 +71,12 @@ def run_migrations_online() -> None:
         DATABASE_URL_SYNC, # type: ignore
         poolclass=NullPool,
     )
+    if is_sqlite:
+        event.listen(connectable, "connect", set_sqlite_pragmas)
 
     with connectable.connect() as connection:
         context.configure(
-            connection=connection, target_metadata=target_metadata
+            connection=connection, target_metadata=target_metadata, render_as_batch=is_sqlite
         )
 
         with context.begin_transaction():
@@ -21,5 +21,8 @@ def upgrade() -> None:
 
 
 def downgrade() -> None:
+    # SQLite has no schemas, the other migrations already dropped their tables
+    if op.get_bind().dialect.name != 'postgresql':
+        return
     op.execute('DROP SCHEMA railway CASCADE;')
     op.execute('CREATE SCHEMA railway;')
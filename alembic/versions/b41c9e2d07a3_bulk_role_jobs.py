@@ -0,0 +1,34 @@
+"""Bulk role jobs
+
+Revision ID: b41c9e2d07a3
+Revises: 72f5f7dd1455
+Create Date: 2026-10-19 10:12:41.518204
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b41c9e2d07a3'
+down_revision: Union[str, None] = '72f5f7dd1455'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('bulk_role_jobs',
+    sa.Column('guild_id', sa.BigInteger(), nullable=False),
+    sa.Column('role_id', sa.BigInteger(), nullable=False),
+    sa.Column('action', sa.String(), nullable=False),
+    sa.Column('member_ids', sa.Text(), nullable=False),
+    sa.Column('cursor', sa.Integer(), nullable=False),
+    sa.Column('failed', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('guild_id')
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('bulk_role_jobs')
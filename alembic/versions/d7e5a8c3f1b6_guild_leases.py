@@ -0,0 +1,31 @@
+"""Guild leases
+
+Revision ID: d7e5a8c3f1b6
+Revises: b41c9e2d07a3
+Create Date: 2026-10-19 15:40:02.734911
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd7e5a8c3f1b6'
+down_revision: Union[str, None] = 'b41c9e2d07a3'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('guild_leases',
+    sa.Column('guild_id', sa.BigInteger(), nullable=False),
+    sa.Column('owner', sa.String(), nullable=False),
+    sa.Column('expires_at', sa.DateTime(timezone=True), nullable=False),
+    sa.PrimaryKeyConstraint('guild_id')
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('guild_leases')
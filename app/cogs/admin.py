@@ -1,26 +1,300 @@
+import asyncio
 import discord
 from discord import app_commands
 from discord.ext import commands
 import logging
+import re
+import time
+from sqlalchemy import update
+from sqlalchemy.exc import IntegrityError
+
+from typing import Optional, List
+
+from app.db.models import BulkRoleJob
+from app.db.engine import AsyncEngineManager
+from app.utils.interactions import deferred
+from app.utils.ratelimit import BucketExecutor
+from app.config import BULK_ROLE_RATE, BULK_ROLE_CONCURRENCY
+
+# Members processed between two checkpoints
+BULK_CHUNK_SIZE = 50
+# Seconds between two progress message edits
+BULK_PROGRESS_INTERVAL = 5
 
 class AdminCog(commands.GroupCog, name='admin'):
     def __init__(self, bot: commands.Bot):
         self.bot = bot
         self.logger = logging.getLogger('bot')
+        self.executor = BucketExecutor(rate=BULK_ROLE_RATE, concurrency=BULK_ROLE_CONCURRENCY)
+        self.bulk_tasks: dict[int, asyncio.Task] = {}
+
+    async def interaction_check(self, interaction: discord.Interaction) -> bool:
+        if await self.bot.is_owner(interaction.user):
+            return True
+        await interaction.response.send_message('This command is owner only!', ephemeral=True)
+        return False
+
+    async def cog_unload(self) -> None:
+        # The checkpoints stay in the database, the jobs can be resumed with /admin bulk_resume
+        for task in self.bulk_tasks.values():
+            task.cancel()
 
     @app_commands.command(name='give_role', description='Gives a role to a user')
     @commands.is_owner()
+    @deferred()
     async def give_role(self, interaction: discord.Interaction, user: discord.Member, role: discord.Role):
-        await interaction.response.send_message('Giving role...', ephemeral=True)
         await user.add_roles(role)
         await interaction.edit_original_response(content='Role given!')
 
     @app_commands.command(name='remove_role', description='Removes a role from a user')
     @commands.is_owner()
+    @deferred()
     async def remove_role(self, interaction: discord.Interaction, user: discord.Member, role: discord.Role):
-        await interaction.response.send_message('Removeing role...', ephemeral=True)
         await user.remove_roles(role)
         await interaction.edit_original_response(content='Role removed!')
 
+    def get_bulk_targets(self, guild: discord.Guild, from_role: Optional[discord.Role], members: Optional[str]) -> List[int]:
+        """
+        Collects the ids of the members a bulk role job should process.
+
+        Parameters:
+            guild (discord.Guild): The guild the job runs in.
+            from_role (Optional[discord.Role]): Every member with this role is targeted.
+            members (Optional[str]): Member mentions or ids, separated by anything.
+
+        Returns:
+            List[int]: The sorted, deduplicated member ids.
+        """
+        member_ids: set[int] = set()
+        if from_role:
+            member_ids.update(member.id for member in from_role.members)
+        if members:
+            member_ids.update(int(member_id) for member_id in re.findall(r'\d{15,21}', members))
+        return sorted(member_ids)
+
+    async def start_bulk_job(self, interaction: discord.Interaction, action: str, role: discord.Role, from_role: Optional[discord.Role], members: Optional[str]) -> None:
+        guild = interaction.guild
+        if not guild:
+            await interaction.edit_original_response(content='Could not determine the guild from the interaction. If the issue persists check how to open an issue in the bot\'s about me.')
+            return
+
+        if guild.id in self.bulk_tasks:
+            await interaction.edit_original_response(content='A bulk role job is already running in this guild. Cancel it with /admin bulk_cancel first.')
+            return
+
+        if not role.is_assignable():
+            await interaction.edit_original_response(content=f'I can\'t manage {role.mention}, it is managed by an integration or not below my highest role.')
+            return
+
+        if not from_role and not members:
+            await interaction.edit_original_response(content='Specify either a role whose members to target or a list of members.')
+            return
+
+        member_ids = self.get_bulk_targets(guild, from_role, members)
+        if not member_ids:
+            await interaction.edit_original_response(content='No members matched.')
+            return
+
+        async with AsyncEngineManager.get_session() as session:
+            existing_job = await session.get(BulkRoleJob, guild.id)
+            if not existing_job:
+                job = BulkRoleJob(guild_id=guild.id, role_id=role.id, action=action, member_ids=','.join(map(str, member_ids)), cursor=0, failed=0)
+                session.add(job)
+                try:
+                    await session.commit()
+                except IntegrityError:
+                    # Another command created a job for the guild since the lookup above
+                    await session.rollback()
+                    existing_job = await session.get(BulkRoleJob, guild.id)
+                    if not existing_job:
+                        await interaction.edit_original_response(content='Another bulk role job was started at the same time, check it with /admin bulk_status.')
+                        return
+
+            if existing_job:
+                await interaction.edit_original_response(content=f'An unfinished bulk role job exists ({existing_job.cursor}/{len(existing_job.member_ids.split(","))} members). Resume it with /admin bulk_resume or drop it with /admin bulk_cancel.')
+                return
+
+        self.spawn_bulk_job(interaction, job)
+
+    def spawn_bulk_job(self, interaction: discord.Interaction, job: BulkRoleJob) -> None:
+        task = asyncio.create_task(self.run_bulk_job(interaction, job))
+        self.bulk_tasks[job.guild_id] = task
+        task.add_done_callback(lambda task: self.on_bulk_job_done(interaction, job, task))
+
+    def on_bulk_job_done(self, interaction: discord.Interaction, job: BulkRoleJob, task: asyncio.Task) -> None:
+        if self.bulk_tasks.get(job.guild_id) is task:
+            del self.bulk_tasks[job.guild_id]
+        if task.cancelled() or task.exception() is None:
+            return
+
+        error = task.exception()
+        self.logger.error(f'Bulk role job in guild(id: {job.guild_id}) failed at {job.cursor} members.', exc_info=error)
+        asyncio.create_task(self.report_bulk_job(
+                interaction,
+                f'The bulk role job stopped after an error at {job.cursor}/{len(job.member_ids.split(","))} members: {error}. Resume it with /admin bulk_resume.',
+                final=True
+                ))
+
+    async def report_bulk_job(self, interaction: discord.Interaction, content: str, final: bool = False) -> None:
+        """
+        Shows the progress of a bulk role job in the interaction's response.
+
+        Interaction tokens expire after 15 minutes, the job carries on even if the progress can't be shown anymore,
+        `final` messages are posted in the channel instead so they aren't lost.
+        """
+        try:
+            await interaction.edit_original_response(content=content)
+        except discord.HTTPException:
+            if final and isinstance(interaction.channel, discord.abc.Messageable):
+                try:
+                    await interaction.channel.send(content, allowed_mentions=discord.AllowedMentions.none())
+                except discord.HTTPException as e:
+                    self.logger.warning(f'Could not post the bulk role job summary in guild(id: {interaction.guild_id}): {e}')
+
+    async def run_bulk_job(self, interaction: discord.Interaction, job: BulkRoleJob) -> None:
+        """
+        Adds or removes a role from every member of the job, starting from its checkpoint.
+
+        The checkpoint is written to the database after every chunk, so an interrupted job at most repeats one chunk.
+        Repeating is harmless, members that already have (or lack) the role are skipped without an API call.
+
+        Parameters:
+            interaction (discord.Interaction): The interaction whose ephemeral response reports the progress.
+            job (BulkRoleJob): The job to run.
+
+        Returns:
+            None
+        """
+        guild = self.bot.get_guild(job.guild_id)
+        role = guild.get_role(job.role_id) if guild else None
+        if not guild or not role:
+            await self.finish_bulk_job(job)
+            await interaction.edit_original_response(content='The role or guild of the job no longer exists, dropped the job.')
+            return
+
+        if not role.is_assignable():
+            # Kept, it can be resumed once the role is below the bot's highest role again
+            await interaction.edit_original_response(content=f'I can\'t manage {role.mention} anymore, move it below my highest role and resume the job.')
+            return
+
+        member_ids = [int(member_id) for member_id in job.member_ids.split(',')]
+        total = len(member_ids)
+        started_at = time.monotonic()
+        start_cursor = job.cursor
+        last_report = 0.0
+
+        async def apply(member_id: int) -> bool:
+            member = guild.get_member(member_id)
+            if not member:
+                return False
+            try:
+                if job.action == 'add' and role not in member.roles:
+                    await self.executor.run(member.add_roles, role, reason='Bulk role assignment')
+                elif job.action == 'remove' and role in member.roles:
+                    await self.executor.run(member.remove_roles, role, reason='Bulk role removal')
+                return True
+            except (discord.HTTPException, RuntimeError) as e:
+                self.logger.warning(f'Bulk role job in guild(id: {guild.id}) failed for member(id: {member_id}): {e}')
+                return False
+
+        verb = 'Giving' if job.action == 'add' else 'Removing'
+        while job.cursor < total:
+            chunk = member_ids[job.cursor:job.cursor + BULK_CHUNK_SIZE]
+            results = await asyncio.gather(*(apply(member_id) for member_id in chunk))
+
+            job.cursor += len(chunk)
+            job.failed += results.count(False)
+            async with AsyncEngineManager.get_session() as session:
+                await session.execute(update(BulkRoleJob).where(BulkRoleJob.guild_id == job.guild_id).values(cursor=job.cursor, failed=job.failed))
+                await session.commit()
+
+            now = time.monotonic()
+            if now - last_report >= BULK_PROGRESS_INTERVAL:
+                last_report = now
+                rate = (job.cursor - start_cursor) / max(now - started_at, 1e-6)
+                eta = round((total - job.cursor) / rate) if rate else 0
+                await self.report_bulk_job(interaction, f'{verb} {role.mention}: {job.cursor}/{total} members processed, {job.failed} failed. ETA: {eta}s')
+
+        await self.finish_bulk_job(job)
+        self.logger.info(f'Bulk role job in guild(id: {guild.id}) done in {time.monotonic() - started_at:.1f}s, {job.failed}/{total} failed.')
+        await self.report_bulk_job(interaction, f'Done! Processed {total} members for {role.mention}, {job.failed} failed or were not in the guild.', final=True)
+
+    async def finish_bulk_job(self, job: BulkRoleJob) -> None:
+        async with AsyncEngineManager.get_session() as session:
+            db_job = await session.get(BulkRoleJob, job.guild_id)
+            if db_job:
+                await session.delete(db_job)
+                await session.commit()
+
+    @app_commands.command(name='bulk_give_role', description='Gives a role to every member of a role or to a list of members')
+    @deferred()
+    async def bulk_give_role(self, interaction: discord.Interaction, role: discord.Role, from_role: Optional[discord.Role] = None, members: Optional[str] = None):
+        await self.start_bulk_job(interaction, 'add', role, from_role, members)
+
+    @app_commands.command(name='bulk_remove_role', description='Removes a role from every member of a role or from a list of members')
+    @deferred()
+    async def bulk_remove_role(self, interaction: discord.Interaction, role: discord.Role, from_role: Optional[discord.Role] = None, members: Optional[str] = None):
+        await self.start_bulk_job(interaction, 'remove', role, from_role, members)
+
+    @app_commands.command(name='bulk_resume', description='Resumes an interrupted bulk role job')
+    @deferred()
+    async def bulk_resume(self, interaction: discord.Interaction):
+        if not interaction.guild_id:
+            await interaction.edit_original_response(content='Could not determine the guild from the interaction. If the issue persists check how to open an issue in the bot\'s about me.')
+            return
+
+        if interaction.guild_id in self.bulk_tasks:
+            await interaction.edit_original_response(content='The bulk role job is still running.')
+            return
+
+        async with AsyncEngineManager.get_session() as session:
+            job = await session.get(BulkRoleJob, interaction.guild_id)
+
+        if not job:
+            await interaction.edit_original_response(content='There is no bulk role job to resume.')
+            return
+
+        self.spawn_bulk_job(interaction, job)
+
+    @app_commands.command(name='bulk_status', description='Shows the progress of the bulk role job')
+    @deferred()
+    async def bulk_status(self, interaction: discord.Interaction):
+        if not interaction.guild_id:
+            await interaction.edit_original_response(content='Could not determine the guild from the interaction. If the issue persists check how to open an issue in the bot\'s about me.')
+            return
+
+        async with AsyncEngineManager.get_session() as session:
+            job = await session.get(BulkRoleJob, interaction.guild_id)
+
+        if not job:
+            await interaction.edit_original_response(content='There is no bulk role job.')
+            return
+
+        state = 'running' if interaction.guild_id in self.bulk_tasks else 'interrupted, resume it with /admin bulk_resume'
+        verb = 'Giving' if job.action == 'add' else 'Removing'
+        await interaction.edit_original_response(content=f'{verb} <@&{job.role_id}>: {job.cursor}/{len(job.member_ids.split(","))} members processed, {job.failed} failed. The job is {state}.')
+
+    @app_commands.command(name='bulk_cancel', description='Cancels the running bulk role job and drops its checkpoint')
+    @deferred()
+    async def bulk_cancel(self, interaction: discord.Interaction):
+        if not interaction.guild_id:
+            await interaction.edit_original_response(content='Could not determine the guild from the interaction. If the issue persists check how to open an issue in the bot\'s about me.')
+            return
+
+        task = self.bulk_tasks.get(interaction.guild_id)
+        if task:
+            task.cancel()
+
+        async with AsyncEngineManager.get_session() as session:
+            job = await session.get(BulkRoleJob, interaction.guild_id)
+            if not job and not task:
+                await interaction.edit_original_response(content='There is no bulk role job to cancel.')
+                return
+            if job:
+                await session.delete(job)
+                await session.commit()
+
+        await interaction.edit_original_response(content='Bulk role job cancelled!')
+
 async def setup(bot: commands.Bot):
     await bot.add_cog(AdminCog(bot))
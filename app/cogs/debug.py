@@ -0,0 +1,125 @@
+import asyncio
+import discord
+from discord import app_commands
+from discord.ext import commands
+import io
+import logging
+import os
+import threading
+import time
+
+from typing import Optional
+
+from app.utils.admission import admission
+from app.utils.diagnostics import LoopLagMonitor, LoopProfiler, dump_tasks
+from app.utils.interactions import ack_stats, deferred
+from app.utils.startup import startup
+from app.config import PROFILE_DIR
+
+# Upper bound for /debug profile, the command has to answer before the interaction token expires
+MAX_PROFILE_DURATION = 120
+
+def format_ms(seconds: Optional[float]) -> str:
+    return 'n/a' if seconds is None else f'{seconds * 1000:.1f}ms'
+
+class DebugCog(commands.GroupCog, name='debug'):
+    def __init__(self, bot: commands.Bot):
+        self.bot = bot
+        self.logger = logging.getLogger('bot')
+        self.lag_monitor = LoopLagMonitor()
+        self.lag_monitor.start()
+        # Cogs are loaded from the event loop, so this is the thread the profiler has to sample
+        self.loop_thread_id = threading.get_ident()
+        self.profiling = False
+
+    async def cog_unload(self) -> None:
+        self.lag_monitor.stop()
+
+    async def interaction_check(self, interaction: discord.Interaction) -> bool:
+        if await self.bot.is_owner(interaction.user):
+            return True
+        await interaction.response.send_message('This command is owner only!', ephemeral=True)
+        return False
+
+    @app_commands.command(name='lag', description='Shows the event loop lag and interaction ack latency. Owner only!')
+    @deferred()
+    async def lag(self, interaction: discord.Interaction):
+        monitor = self.lag_monitor
+        content = (
+            f'**Event loop lag** (last {len(monitor.samples)} samples, every {monitor.interval}s)\n'
+            f'p50: {format_ms(monitor.percentile(50))} / p95: {format_ms(monitor.percentile(95))} / '
+            f'p99: {format_ms(monitor.percentile(99))} / max: {format_ms(max(monitor.samples, default=None))}\n'
+            f'**Interaction ack latency** ({ack_stats.acked} acked, {ack_stats.missed} missed the deadline)\n'
+            f'p50: {format_ms(ack_stats.percentile(50))} / p95: {format_ms(ack_stats.percentile(95))} / '
+            f'p99: {format_ms(ack_stats.percentile(99))}\n'
+            f'**Admission:** {admission.admitted} admitted ({admission.queued} after queueing), '
+            f'shed by user: {admission.shed["user"]} / guild: {admission.shed["guild"]} / global: {admission.shed["global"]}\n'
+            f'**Tasks:** {len(asyncio.all_tasks())}'
+        )
+        await interaction.edit_original_response(content=content)
+
+    @app_commands.command(name='search', description='Shows the latency and outcomes of every search source. Owner only!')
+    @deferred()
+    async def search(self, interaction: discord.Interaction):
+        music_cog = self.bot.get_cog('music')
+        search_strategy = getattr(music_cog, 'search_strategy', None)
+        if not search_strategy:
+            await interaction.edit_original_response(content='The music cog is not loaded.')
+            return
+
+        lines = []
+        for source, stats in search_strategy.stats.items():
+            lines.append(
+                f'**{source}**: p50: {format_ms(stats.percentile(50))} / p95: {format_ms(stats.percentile(95))} / '
+                f'{stats.wins} won, {stats.timeouts} timed out, {stats.errors} failed'
+            )
+            if source in search_strategy.sources:
+                lines[-1] += f', hedged after {format_ms(search_strategy.current_hedge_delay(source))}'
+        await interaction.edit_original_response(content='\n'.join(lines))
+
+    @app_commands.command(name='startup', description='Shows how long the imports took and when the bot became ready. Owner only!')
+    @deferred()
+    async def startup_report(self, interaction: discord.Interaction):
+        await interaction.edit_original_response(content=f'```\n{startup.format()[:1900]}\n```')
+
+    @app_commands.command(name='tasks', description='Dumps every running asyncio task with its stack. Owner only!')
+    @deferred()
+    async def tasks(self, interaction: discord.Interaction):
+        dump = dump_tasks()
+        await interaction.edit_original_response(
+                content=f'{len(asyncio.all_tasks())} tasks running.',
+                attachments=[discord.File(io.BytesIO(dump.encode()), filename='tasks.txt')]
+                )
+
+    @app_commands.command(name='profile', description='Samples the event loop for a while and uploads the profile. Owner only!')
+    @app_commands.describe(duration='Seconds to sample for')
+    @deferred()
+    async def profile(self, interaction: discord.Interaction, duration: app_commands.Range[int, 1, MAX_PROFILE_DURATION] = 10):
+        if self.profiling:
+            await interaction.edit_original_response(content='A profile is already being captured.')
+            return
+
+        self.profiling = True
+        try:
+            await interaction.edit_original_response(content=f'Profiling the event loop for {duration}s...')
+            profiler = LoopProfiler(self.loop_thread_id)
+            # Sampled from a worker thread, the loop keeps running normally while it is profiled
+            await asyncio.to_thread(profiler.run, duration)
+        finally:
+            self.profiling = False
+
+        collapsed = profiler.collapsed()
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        path = os.path.join(PROFILE_DIR, f'loop-{time.strftime("%Y%m%d-%H%M%S")}.folded')
+        with open(path, 'w') as file:
+            file.write(collapsed)
+        self.logger.info(f'Wrote a {duration}s event loop profile with {profiler.samples} samples to {path}.')
+
+        top = '\n'.join(f'{count * 100 / max(profiler.samples, 1):5.1f}% {frame}' for frame, count in profiler.top_frames())
+        await interaction.edit_original_response(
+                content=f'Captured {profiler.samples} samples in {duration}s, saved to `{path}`.\n```\n{top[:1800]}\n```',
+                attachments=[discord.File(io.BytesIO(collapsed.encode()), filename=os.path.basename(path))]
+                )
+
+async def setup(bot: commands.Bot):
+    await bot.add_cog(DebugCog(bot))
@@ -7,20 +7,87 @@ from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from typing import Optional, List
+import itertools
 import time
 
 import wavelink
 
 from app.db.models import MusicPlayer
 from app.db.engine import AsyncEngineManager
-from app.config import LAVALINK_HOST 
+from app.db.state import create_state_backend
+from app.music.queue import IndexedPlayer, IndexedQueue
+from app.music.search import HedgedSearch
+from app.utils.actor import GuildActor
+from app.utils.admission import admitted
+from app.utils.guild_state import GuildState, GuildStateCache
+from app.utils.interactions import deferred, respond
+from app.config import LAVALINK_HOST, GUILD_STATE_BUDGET, GUILD_IDLE_TIMEOUT, SEARCH_SOURCES, SEARCH_TIMEOUT, SEARCH_HEDGE_DELAY
+
+# Amount of queued songs listed in the player message, Discord caps the embed description at 4096 characters
+QUEUE_PAGE_SIZE = 20
+# Seconds a modal waits for its submission, dismissed modals are dropped from discord.py's modal store after that
+MODAL_TIMEOUT = 600
 
 class MusicCog(commands.GroupCog, name='music'):
     def __init__(self, bot: commands.Bot):
         self.bot = bot
         self.logger = logging.getLogger('bot')
+        # Every player mutation and render of a guild goes through its mailbox, so they never interleave
+        self.actor = GuildActor()
+        self.search_strategy = HedgedSearch(sources=SEARCH_SOURCES, timeout=SEARCH_TIMEOUT, hedge_delay=SEARCH_HEDGE_DELAY)
+        # Rendered player messages and views, evicted when idle or over budget and rebuilt on the next use
+        self.guild_states = GuildStateCache(budget=GUILD_STATE_BUDGET, idle_timeout=GUILD_IDLE_TIMEOUT, on_evict=self.on_guild_state_evicted)
+        # Guild ownership and invalidations shared with the other processes of the bot
+        self.state = create_state_backend()
+        self.state.subscribe(self.on_state_invalidated)
+        self.state.lease_needed = self.has_connected_player
+        self.bot.loop.create_task(self.state.start())
         self.bot.loop.create_task(self.connect_nodes())
         self.bot.loop.create_task(self.update_all_player_message())
+        self.reclaim_task = self.bot.loop.create_task(self.reclaim_idle_guilds())
+
+    async def cog_unload(self) -> None:
+        self.reclaim_task.cancel()
+        await self.actor.close()
+        self.guild_states.clear()
+        await self.state.close()
+
+    def on_guild_state_evicted(self, state: GuildState) -> None:
+        self.logger.debug(f'Evicted the state of the guild(id: {state.guild_id}), {len(self.guild_states)} guilds cached, ~{self.guild_states.total_size} bytes.')
+
+    def on_state_invalidated(self, guild_id: int, kind: str) -> None:
+        self.logger.debug(f'Another process invalidated the {kind} state of the guild(id: {guild_id}).')
+        self.guild_states.evict(guild_id)
+
+    def has_connected_player(self, guild_id: int) -> bool:
+        guild = self.bot.get_guild(guild_id)
+        return bool(guild and isinstance(guild.voice_client, wavelink.Player) and guild.voice_client.connected)
+
+    async def invalidate_guild(self, guild_id: int, kind: str) -> None:
+        """Drops the cached state of the guild in this and every other process of the bot."""
+        self.guild_states.evict(guild_id)
+        await self.state.publish(guild_id, kind)
+
+    async def acquire_guild(self, guild_id: int) -> bool:
+        """Takes ownership of the guild's player, returns False if another process of the bot owns it."""
+        newly_acquired = not self.state.holds_lease(guild_id)
+        if not await self.state.acquire_lease(guild_id):
+            return False
+        if newly_acquired:
+            await self.invalidate_guild(guild_id, 'owner')
+        return True
+
+    async def release_guild(self, guild_id: int) -> None:
+        if self.state.holds_lease(guild_id):
+            await self.state.release_lease(guild_id)
+            await self.state.publish(guild_id, 'owner')
+
+    async def reclaim_idle_guilds(self) -> None:
+        while True:
+            await asyncio.sleep(60)
+            evicted = self.guild_states.sweep()
+            if evicted:
+                self.logger.info(f'Evicted {evicted} idle guilds, {len(self.guild_states)} guilds cached, ~{self.guild_states.total_size} bytes.')
 
     async def connect_nodes(self):
         await self.bot.wait_until_ready()
@@ -30,6 +97,28 @@ class MusicCog(commands.GroupCog, name='music'):
         await wavelink.Pool.connect(nodes=[node], client=self.bot, cache_capacity=100)
         self.logger.info('Connected to the Lavalink node!')
 
+    async def run_in_guild(self, guild_id: Optional[int], func, *args, **kwargs):
+        """
+        Runs `func` through the mailbox of the guild, so it is ordered with every other player operation of that guild.
+        Without a guild there is no player to race for and `func` is simply awaited.
+        """
+        if guild_id is None:
+            return await func(*args, **kwargs)
+        return await self.actor.run(guild_id, func, *args, **kwargs)
+
+    def request_player_update(self, guild: discord.Guild) -> None:
+        """Schedules a render of the player message, every request made during a burst of operations results in a single render."""
+        self.actor.after_burst(guild.id, 'render', lambda: self.update_player_message(guild))
+
+    def request_playback(self, player: wavelink.Player) -> None:
+        """Starts playing the next track once the current burst of operations is done, unless something is already playing."""
+        async def start_playback():
+            if player.connected and not player.playing and not player.queue.is_empty:
+                await player.play(player.queue.get())
+
+        if player.guild:
+            self.actor.after_burst(player.guild.id, 'play', start_playback)
+
     async def get_player_from_interaction(self, interaction: discord.Interaction) -> wavelink.Player | None:
         if not interaction.guild:
             self.logger.error('Guild could not determine the guild from an interaction. Probbably a network issue, safe to ignore unless it happens often.')
@@ -53,7 +142,7 @@ class MusicCog(commands.GroupCog, name='music'):
         async def raise_error(msg: str, level: int = logging.DEBUG):
             self.logger.log(level, msg)
             if interaction and edit_response:
-                await interaction.edit_original_response(content=msg)
+                await respond(interaction, msg)
 
         if channel:
             player: Optional[wavelink.Player] = wavelink.Pool.get_node().get_player(channel.guild.id)
@@ -69,26 +158,34 @@ class MusicCog(commands.GroupCog, name='music'):
             return None
 
         if player and player.connected:
-            if player.channel == channel:
-                return player
-            if force or player.channel.members.count == 1:
+            if player.channel != channel and (force or player.channel.members.count == 1):
                 await player.disconnect(force=True)
                 await asyncio.sleep(1)
             else:
+                # Players outlive the cog across /reload, which released their leases, so the lease is taken (again) here too
+                if not self.state.holds_lease(channel.guild.id) and not await self.acquire_guild(channel.guild.id):
+                    await raise_error('The player of this guild is run by another instance of the bot. Try again in a minute.', level=logging.WARNING)
+                    return None
                 return player
 
+        if not await self.acquire_guild(channel.guild.id):
+            await raise_error('The player of this guild is run by another instance of the bot. Try again in a minute.', level=logging.WARNING)
+            return None
+
         try:
-            player = await channel.connect(cls=wavelink.Player)
+            player = await channel.connect(cls=IndexedPlayer)
             player.queue.mode = wavelink.QueueMode.normal
             player.autoplay = wavelink.AutoPlayMode.enabled
             return player
         except Exception as e:
+            await self.release_guild(channel.guild.id)
             await raise_error(f'Error while trying to connect to voice channel: {e}', level=logging.ERROR)
             return None
 
     async def leave_vc(self, guild: discord.Guild) -> None:
         if guild.voice_client:
             await guild.voice_client.disconnect(force=True)
+        await self.release_guild(guild.id)
 
     async def add_audio_to_queue(self, interaction: discord.Interaction, url_or_search: str, prepend: bool = False) -> None:
         """
@@ -101,17 +198,18 @@ class MusicCog(commands.GroupCog, name='music'):
         Returns:
             None
         """
-        if interaction.response.is_done == False:
-            await interaction.edit_original_response(content='Searching for the audio...')
-        else:
-            await interaction.response.send_message('Searching for the audio...', ephemeral=True)
-        
+        await respond(interaction, 'Searching for the audio...')
+
         player = await self.get_player_from_interaction(interaction)
         if not player:
             await interaction.edit_original_response(content='Player not found. Add the bot to a voice channel to create it.') 
             return
 
-        tracks: wavelink.Search = await wavelink.Playable.search(url_or_search)
+        try:
+            tracks: wavelink.Search = await self.search_strategy.search(url_or_search)
+        except asyncio.TimeoutError:
+            await interaction.edit_original_response(content='The search timed out, try again in a bit.')
+            return
         if not tracks:
             await interaction.edit_original_response(content='No tracks found.')
             return
@@ -121,14 +219,19 @@ class MusicCog(commands.GroupCog, name='music'):
             return
 
         track: wavelink.Playable = tracks[0]
-        if prepend == True:
-            self.logger.info('Prepending the track to the queue.')
-            player.queue.put_at(0, track)
-        else:
-            self.logger.info('Appending the track to the queue.')
-            await player.queue.put_wait(track)
 
-        await self.update_player_message(interaction.guild) # type: ignore # interaction.guild cannot be none since checked in get_player_from_interaction
+        async def enqueue():
+            if prepend == True:
+                self.logger.info('Prepending the track to the queue.')
+                player.queue.put_at(0, track)
+            else:
+                self.logger.info('Appending the track to the queue.')
+                player.queue.put(track)
+
+            self.request_playback(player)
+            self.request_player_update(interaction.guild) # type: ignore # interaction.guild cannot be none since checked in get_player_from_interaction
+
+        await self.run_in_guild(interaction.guild_id, enqueue)
 
         await interaction.edit_original_response(content=f'Added **{track.title}** by **{track.author}**to the queue!')
 
@@ -144,42 +247,42 @@ class MusicCog(commands.GroupCog, name='music'):
         Returns:
             None
         """
-        async def respond(content: str):
+        async def respond_error(content: str):
             if respond_to_interaction:
-                if interaction.response.is_done:
-                    await interaction.edit_original_response(content=content)
-                else:
-                    await interaction.response.send_message(content, ephemeral=True)
+                await respond(interaction, content)
 
-        player: Optional[wavelink.Player] = await self.get_player_from_interaction(interaction)
-        if not player or not player.playing:
-            await respond('There is no audio playing.')
-            return
-
-        if pause == 2:
-            if not player.paused or player.playing:
-                await player.pause(not player.paused)
-            else:
-                await respond('There is no audio paused.')
-                return
-        elif pause == 1:
-            if not player.paused:
-                await player.pause(True)
-            else:
-                await respond('The audio is already paused.')
-                return
-        elif pause == 0:
-            if player.paused:
-                await player.pause(False)
-            else:
-                await respond('The audio is not paused.')
+        async def toggle():
+            player: Optional[wavelink.Player] = await self.get_player_from_interaction(interaction)
+            if not player or not player.playing:
+                await respond_error('There is no audio playing.')
                 return
 
-        if interaction.guild:
-            await self.update_player_message(interaction.guild)
+            if pause == 2:
+                if not player.paused or player.playing:
+                    await player.pause(not player.paused)
+                else:
+                    await respond_error('There is no audio paused.')
+                    return
+            elif pause == 1:
+                if not player.paused:
+                    await player.pause(True)
+                else:
+                    await respond_error('The audio is already paused.')
+                    return
+            elif pause == 0:
+                if player.paused:
+                    await player.pause(False)
+                else:
+                    await respond_error('The audio is not paused.')
+                    return
+
+            if interaction.guild:
+                self.request_player_update(interaction.guild)
+
+        await self.run_in_guild(interaction.guild_id, toggle)
 
     def get_add_song_modal(self) -> discord.ui.Modal:
-        modal = discord.ui.Modal(title='Add song to queue')
+        modal = discord.ui.Modal(title='Add song to queue', timeout=MODAL_TIMEOUT)
 
         url_or_search_input = discord.ui.TextInput(
                 label='Enter the url or search query for the audio',
@@ -191,14 +294,93 @@ class MusicCog(commands.GroupCog, name='music'):
 
         modal.add_item(url_or_search_input)
 
+        @deferred()
+        @admitted(cost=2, policy='reject')
         async def on_submit_handler(interaction: discord.Interaction):
             url_or_search = url_or_search_input.value
-            player = await self.join_vc(interaction=interaction, edit_response=True)
+            await self.run_in_guild(interaction.guild_id, self.join_vc, interaction=interaction, edit_response=True)
 
+            # Playback is started by add_audio_to_queue once the guild's mailbox is drained
             await self.add_audio_to_queue(interaction, url_or_search)
 
-            if player and not player.playing and not player.queue.is_empty:
-                await player.play(player.queue.get())
+        modal.on_submit = on_submit_handler
+        return modal
+
+    def get_queue_position_modal(self, player: Optional[wavelink.Player], title: str, labels: List[str], songs: int, action) -> discord.ui.Modal:
+        """
+        Creates a modal asking for positions in the queue and applies `action` to the player of the guild.
+
+        The first `songs` inputs pick songs of the queue page shown in the player. Their entry ids are recorded when the modal
+        opens and resolved to their current positions on submit, so songs ending or the queue being edited in between
+        doesn't make the action hit another song. The other inputs are plain positions, e.g. where to move a song.
+
+        Parameters:
+            player (Optional[wavelink.Player]): The player of the guild when the modal is opened.
+            title (str): The title of the modal.
+            labels (List[str]): The label of every position input, `action` receives the positions in the same order.
+            songs (int): The amount of leading inputs that pick a song.
+            action (Callable[..., str]): Called with the player and the 0 based positions in the guild's mailbox, returns the response message.
+
+        Returns:
+            discord.ui.Modal: The modal.
+        """
+        queue = player.queue if player and isinstance(player.queue, IndexedQueue) else None
+        shown_entry_ids = [queue.entry_id(i) for i in range(min(QUEUE_PAGE_SIZE, queue.count))] if queue else []
+
+        modal = discord.ui.Modal(title=title, timeout=MODAL_TIMEOUT)
+
+        position_inputs = [discord.ui.TextInput(
+                label=label,
+                style=discord.TextStyle.short,
+                placeholder='Position in the queue',
+                required=True,
+                max_length=6
+                ) for label in labels]
+
+        for position_input in position_inputs:
+            modal.add_item(position_input)
+
+        @deferred()
+        @admitted()
+        async def on_submit_handler(interaction: discord.Interaction):
+            try:
+                positions = [int(position_input.value) - 1 for position_input in position_inputs]
+            except ValueError:
+                positions = [-1]
+            if any(position < 0 for position in positions):
+                await interaction.edit_original_response(content='Positions have to be numbers from the queue, starting at 1.')
+                return
+
+            async def edit_queue() -> str:
+                player = await self.get_player_from_interaction(interaction)
+                if not player:
+                    return 'Player not found. Add the bot to a voice channel to create it.'
+
+                resolved = list(positions)
+                for i in range(songs):
+                    # Songs past the shown page couldn't be read off the player, their position is taken as is
+                    if positions[i] >= len(shown_entry_ids):
+                        continue
+                    # A player created since then has a queue of its own, the recorded songs are gone with the old one
+                    if not queue or player.queue is not queue:
+                        return 'That song is no longer in the queue.'
+                    try:
+                        resolved[i] = queue.index_of(shown_entry_ids[positions[i]])
+                    except KeyError:
+                        return 'That song is no longer in the queue.'
+
+                try:
+                    content = action(player, *resolved)
+                except (IndexError, wavelink.QueueEmpty):
+                    # The queue may have drained while the modal was open
+                    return 'There is no audio at that position in the queue.'
+
+                if interaction.guild:
+                    self.request_player_update(interaction.guild)
+                return content
+
+            content = await self.run_in_guild(interaction.guild_id, edit_queue)
+            await interaction.edit_original_response(content=content)
 
         modal.on_submit = on_submit_handler
         return modal
@@ -212,74 +394,147 @@ class MusicCog(commands.GroupCog, name='music'):
         async def play_callback(interaction: discord.Interaction):
             await interaction.response.send_modal(self.get_add_song_modal())
 
+        @deferred()
+        @admitted()
         async def stop_callback(interaction: discord.Interaction):
-            player = await self.get_player_from_interaction(interaction)
-            if player and player.playing:
-                await player.disconnect()
-            await interaction.response.send_message('Stopped the audio!', ephemeral=True)
+            async def stop():
+                player = await self.get_player_from_interaction(interaction)
+                if player and player.playing:
+                    await player.disconnect()
+                    # The lease is only given up together with the voice connection, the guild stays ours while still connected
+                    if interaction.guild:
+                        await self.release_guild(interaction.guild.id)
+                if interaction.guild:
+                    self.request_player_update(interaction.guild)
+
+            await self.run_in_guild(interaction.guild_id, stop)
             await interaction.delete_original_response()
-            if interaction.guild:
-                await self.update_player_message(interaction.guild)
 
+        @deferred()
+        @admitted()
         async def skip_callback(interaction: discord.Interaction):
-            player = await self.get_player_from_interaction(interaction)
-            if player and player.playing:
-                await player.skip()
-            await interaction.response.send_message('Skipped the song', ephemeral=True)
+            async def skip():
+                player = await self.get_player_from_interaction(interaction)
+                if player and player.playing:
+                    await player.skip()
+                if interaction.guild:
+                    self.request_player_update(interaction.guild)
+
+            await self.run_in_guild(interaction.guild_id, skip)
             await interaction.delete_original_response()
-            if interaction.guild:
-                await self.update_player_message(interaction.guild)
 
         async def add_song_callback(interaction: discord.Interaction):
             await interaction.response.send_modal(self.get_add_song_modal())
 
+        def remove_track(player: wavelink.Player, position: int) -> str:
+            track = player.queue.peek(position)
+            player.queue.delete(position)
+            return f'Removed **{track.title}** from the queue!'
+
+        def swap_tracks(player: wavelink.Player, first: int, second: int) -> str:
+            player.queue.swap(first, second)
+            return f'Swapped **{player.queue.peek(second).title}** and **{player.queue.peek(first).title}**!'
+
+        def move_track(player: wavelink.Player, source: int, destination: int) -> str:
+            player.queue.move(source, destination) # type: ignore # players are created as IndexedPlayer in join_vc
+            return f'Moved **{player.queue.peek(destination).title}** to position {destination + 1}!'
+
+        async def remove_callback(interaction: discord.Interaction):
+            player = await self.get_player_from_interaction(interaction)
+            await interaction.response.send_modal(self.get_queue_position_modal(player, 'Remove song from queue', ['Position of the song'], 1, remove_track))
+
+        async def swap_callback(interaction: discord.Interaction):
+            player = await self.get_player_from_interaction(interaction)
+            await interaction.response.send_modal(self.get_queue_position_modal(player, 'Swap songs in queue', ['Position of the first song', 'Position of the second song'], 2, swap_tracks))
+
+        async def move_callback(interaction: discord.Interaction):
+            player = await self.get_player_from_interaction(interaction)
+            await interaction.response.send_modal(self.get_queue_position_modal(player, 'Move song in queue', ['Position of the song', 'New position of the song'], 1, move_track))
+
+        @deferred()
+        @admitted()
+        async def shuffle_callback(interaction: discord.Interaction):
+            async def shuffle():
+                player = await self.get_player_from_interaction(interaction)
+                if player:
+                    player.queue.shuffle()
+                if interaction.guild:
+                    self.request_player_update(interaction.guild)
+
+            await self.run_in_guild(interaction.guild_id, shuffle)
+            await interaction.delete_original_response()
+
+        @deferred()
+        @admitted()
+        async def clear_callback(interaction: discord.Interaction):
+            async def clear():
+                player = await self.get_player_from_interaction(interaction)
+                if player:
+                    player.queue.clear()
+                if interaction.guild:
+                    self.request_player_update(interaction.guild)
+
+            await self.run_in_guild(interaction.guild_id, clear)
+            await interaction.delete_original_response()
+
+        @deferred()
+        @admitted()
         async def resume_song_callback(interaction: discord.Interaction):
-            await interaction.response.send_message('Resumed the audio!', ephemeral=True)
             await self.pause_resume_audio(interaction, 0)
             await interaction.delete_original_response()
-            if interaction.guild:
-                await self.update_player_message(interaction.guild)
 
+        @deferred()
+        @admitted()
         async def pause_song_callback(interaction: discord.Interaction):
-            await interaction.response.send_message('Paused the audio!', ephemeral=True)
             await self.pause_resume_audio(interaction, 1)
             await interaction.delete_original_response()
-            if interaction.guild:
-                await self.update_player_message(interaction.guild)
 
         if not player or not player.playing:
-            button = Button(label='Play', style=ButtonStyle.green)
+            button = Button(label='Play', custom_id='music:play', style=ButtonStyle.green)
             button.callback = play_callback
             view.add_item(button)
 
         if player and player.playing and not player.paused:
-            button = Button(label='Pause', style=ButtonStyle.gray)
+            button = Button(label='Pause', custom_id='music:pause', style=ButtonStyle.gray)
             button.callback = pause_song_callback
             view.add_item(button)
 
         if player and  player.playing and player.paused:
-            button = Button(label='Resume', style=ButtonStyle.gray)
+            button = Button(label='Resume', custom_id='music:resume', style=ButtonStyle.gray)
             button.callback = resume_song_callback
             view.add_item(button)
 
-        button = Button(label='Skip', style=ButtonStyle.gray, disabled=not player or not player.playing)
+        button = Button(label='Skip', custom_id='music:skip', style=ButtonStyle.gray, disabled=not player or not player.playing)
         button.callback = skip_callback
         view.add_item(button)
 
-        button = Button(label='Stop', style=ButtonStyle.red, disabled=not player)
+        button = Button(label='Stop', custom_id='music:stop', style=ButtonStyle.red, disabled=not player)
         button.callback = stop_callback
         view.add_item(button)
 
-        button = Button(label='Add song', style=ButtonStyle.gray, row=1, disabled=not player)
+        button = Button(label='Add song', custom_id='music:add_song', style=ButtonStyle.gray, row=1, disabled=not player)
         button.callback = add_song_callback
         view.add_item(button)
 
-        # view.add_item(Button(label='Remove song', style=ButtonStyle.gray, row=1, disabled=not player or player.queue.is_empty))
-        view.add_item(Button(label='Remove', style=ButtonStyle.gray, row=1, disabled=True))
+        button = Button(label='Remove', custom_id='music:remove', style=ButtonStyle.gray, row=1, disabled=not player or player.queue.is_empty)
+        button.callback = remove_callback
+        view.add_item(button)
+
+        button = Button(label='Swap', custom_id='music:swap', style=ButtonStyle.gray, row=1, disabled=not player or player.queue.count < 2)
+        button.callback = swap_callback
+        view.add_item(button)
+
+        button = Button(label='Move', custom_id='music:move', style=ButtonStyle.gray, row=1, disabled=not player or player.queue.count < 2)
+        button.callback = move_callback
+        view.add_item(button)
 
-        view.add_item(Button(label='Swap', style=ButtonStyle.gray, row=1, disabled=True))
+        button = Button(label='Shuffle', custom_id='music:shuffle', style=ButtonStyle.gray, row=2, disabled=not player or player.queue.count < 2)
+        button.callback = shuffle_callback
+        view.add_item(button)
 
-        # view.add_item(Button(label='Clear queue', style=ButtonStyle.red, row=1, disabled=not player or player.queue.is_empty))
+        button = Button(label='Clear queue', custom_id='music:clear', style=ButtonStyle.red, row=2, disabled=not player or player.queue.is_empty)
+        button.callback = clear_callback
+        view.add_item(button)
 
         return view
 
@@ -295,9 +550,10 @@ class MusicCog(commands.GroupCog, name='music'):
 
         queue_content = ''
         if not player.queue.is_empty == True:
-            for i in range(0, player.queue.count):
-                track = player.queue.peek(i)
+            for i, track in enumerate(itertools.islice(player.queue, QUEUE_PAGE_SIZE)):
                 queue_content += f'{i+1}.\u200B [{track.title}]({track.uri}) -- {track.author} -- {round(track.length/60000)}:{round(track.length/1000)%60} \n'
+            if player.queue.count > QUEUE_PAGE_SIZE:
+                queue_content += f'... and {player.queue.count - QUEUE_PAGE_SIZE} more'
         else:
             queue_content = 'No audio in the queue.'
 
@@ -317,17 +573,30 @@ class MusicCog(commands.GroupCog, name='music'):
 
         return embeds
 
-    async def update_player_message(self, guild: discord.Guild) -> None:
+    async def fetch_player_message(self, guild: discord.Guild) -> Optional[discord.Message]:
+        """
+        Looks up the player message of the guild in the database and fetches it from Discord.
+        Database entries pointing to a channel or message that no longer exists are deleted.
+
+        Parameters:
+            guild (discord.Guild): The guild of the player message.
+
+        Returns:
+            Optional[discord.Message]: The player message if the guild has one.
+        """
         async with AsyncEngineManager.get_session() as session:
             db_player_message = await session.get(MusicPlayer, guild.id)
             if not db_player_message:
-                return
+                return None
 
-            player_channel = await guild.fetch_channel(db_player_message.channel_id)
+            try:
+                player_channel = await guild.fetch_channel(db_player_message.channel_id)
+            except discord.NotFound:
+                player_channel = None
             if not player_channel:
                 await session.delete(db_player_message)
                 await session.commit()
-                return
+                return None
 
             if not isinstance(player_channel, discord.TextChannel):
                 self.logger.error(f'Channel {player_channel.id} is not a text channel. This should not happen, check how the id if a non-text channel got into the database.'
@@ -335,12 +604,41 @@ class MusicCog(commands.GroupCog, name='music'):
                                   f'Deleting the false player message from the database.')
                 await session.delete(db_player_message)
                 await session.commit()
-                return
+                return None
 
-            player_message = await player_channel.fetch_message(db_player_message.message_id)
+            try:
+                player_message = await player_channel.fetch_message(db_player_message.message_id)
+            except discord.NotFound:
+                player_message = None
             if not player_message:
                 await session.delete(db_player_message)
                 await session.commit()
+                return None
+
+        return player_message
+
+    def set_player_view(self, state: GuildState, message_id: int, view: discord.ui.View) -> None:
+        """
+        Makes `view` the cached view of the guild's player message and stops the one it replaces,
+        so buttons that are not part of the new view stop being dispatched.
+        """
+        old_view = state.view
+        state.view = view
+        if old_view and old_view is not view:
+            # Stopping the old view also unregisters the custom ids it shares with the new one, register the new one again right away
+            old_view.stop()
+            self.bot.add_view(view, message_id=message_id)
+
+    async def update_player_message(self, guild: discord.Guild) -> None:
+        # The process owning the guild's player renders its message, anyone else would show a stale player
+        if not await self.state.may_own(guild.id):
+            return
+
+        state = self.guild_states.get(guild.id)
+        player_message = state.player_message if state else None
+        if not player_message:
+            player_message = await self.fetch_player_message(guild)
+            if not player_message:
                 return
 
         player: Optional[wavelink.Player] = wavelink.Pool.get_node().get_player(guild.id)
@@ -351,7 +649,25 @@ class MusicCog(commands.GroupCog, name='music'):
 
         player_view = await self.create_music_player_view(player)
 
-        await player_message.edit(embeds=player_embeds, view=player_view)
+        # Nothing changed since the last render, skip the edit
+        signature = ([embed.to_dict() for embed in player_embeds], [(item.custom_id, item.label, item.disabled) for item in player_view.children if isinstance(item, discord.ui.Button)])
+        if state and state.view and state.signature == signature:
+            return
+
+        try:
+            await player_message.edit(embeds=player_embeds, view=player_view)
+        except discord.NotFound:
+            # The cached message was deleted, the next render looks it up in the database again
+            self.guild_states.evict(guild.id)
+            return
+
+        # The state might have been evicted while editing, get_or_create puts it back
+        state = self.guild_states.get_or_create(guild.id)
+        state.player_message = player_message
+        state.embeds = player_embeds
+        self.set_player_view(state, player_message.id, player_view)
+        state.signature = signature
+        self.guild_states.resize(guild.id)
 
     async def update_all_player_message(self) -> None:
         async with AsyncEngineManager.get_session() as session:
@@ -362,11 +678,45 @@ class MusicCog(commands.GroupCog, name='music'):
                     await session.delete(player)
                     continue
 
-                await self.update_player_message(guild)
+                self.request_player_update(guild)
             
             await session.commit()
 
 
+    @commands.Cog.listener()
+    async def on_interaction(self, interaction: discord.Interaction) -> None:
+        if interaction.guild_id:
+            self.guild_states.touch(interaction.guild_id)
+
+        if interaction.type != discord.InteractionType.component or not interaction.guild or not interaction.message:
+            return
+        custom_id = (interaction.data or {}).get('custom_id', '')
+        if not isinstance(custom_id, str) or not custom_id.startswith('music:'):
+            return
+
+        # While the guild's state is cached discord.py dispatches the click to its view
+        state = self.guild_states.get(interaction.guild.id)
+        if state and state.view:
+            return
+
+        # The view was evicted, rehydrate it and handle the click ourselves
+        player: Optional[wavelink.Player] = wavelink.Pool.get_node().get_player(interaction.guild.id)
+        view = await self.create_music_player_view(player)
+        self.bot.add_view(view, message_id=interaction.message.id)
+
+        state = self.guild_states.get_or_create(interaction.guild.id)
+        state.player_message = interaction.message
+        state.view = view
+        self.guild_states.resize(interaction.guild.id)
+
+        for item in view.children:
+            if isinstance(item, discord.ui.Button) and item.custom_id == custom_id and not item.disabled:
+                await item.callback(interaction)
+                return
+
+        await interaction.response.send_message('The player was outdated, try again.', ephemeral=True)
+        self.request_player_update(interaction.guild)
+
     @commands.Cog.listener()
     async def on_wavelink_player_update(self, payload: wavelink.PlayerUpdateEventPayload) -> None:
         if not payload.player or not payload.player.guild:
@@ -377,18 +727,32 @@ class MusicCog(commands.GroupCog, name='music'):
     async def on_wavelink_track_start(self, payload: wavelink.TrackEndEventPayload) -> None:
         if not payload.player or not payload.player.guild:
             return
-        await self.update_player_message(payload.player.guild)
+        self.request_player_update(payload.player.guild)
 
     @commands.Cog.listener()
     async def on_wavelink_inactive_player(self, player: wavelink.Player) -> None:
-        if player.guild:
-            await self.update_player_message(player.guild)
+        if not player.guild:
+            await player.disconnect()
+            return
+
+        guild = player.guild
 
-        await player.disconnect()
+        async def release_state():
+            self.guild_states.evict(guild.id)
+
+        async def disconnect():
+            await player.disconnect()
+            await self.release_guild(guild.id)
+            self.request_player_update(guild)
+            # Nothing left to show after the last render, the state is rebuilt from the database once the guild is used again
+            self.actor.after_burst(guild.id, 'evict', release_state)
+
+        await self.actor.run(guild.id, disconnect)
 
 
     @app_commands.command(name='create_player', description='Creates a music player. Owner only!')
     @commands.is_owner()
+    @deferred()
     async def create_player(self, interaction: discord.Interaction, channel: Optional[discord.TextChannel] = None):
 
         async def make_player(channel: discord.TextChannel, session: AsyncSession) -> int:
@@ -399,9 +763,19 @@ class MusicCog(commands.GroupCog, name='music'):
             view = await self.create_music_player_view(player=None)
             playerMessage = await channel.send(embeds=playerEmbeds, view=view)
 
+            # Cached right away, discord.py dispatches clicks to the view and on_interaction only rehydrates guilds without one
+            state = self.guild_states.get_or_create(channel.guild.id)
+            state.player_message = playerMessage
+            state.embeds = playerEmbeds
+            state.signature = None
+            self.set_player_view(state, playerMessage.id, view)
+            self.guild_states.resize(channel.guild.id)
+
             session.add(MusicPlayer(guild_id=interaction.guild_id, channel_id=channel.id, message_id=playerMessage.id))
             return 0
 
+        cog = self
+
         class MoveConfirmationView(discord.ui.View):
             def __init__(self, interaction: discord.Interaction, session: AsyncSession, oldPlayerMessage: discord.Message, destinationChannel: discord.TextChannel, oldMusicPlayer: MusicPlayer):
                 super().__init__()
@@ -412,10 +786,12 @@ class MusicCog(commands.GroupCog, name='music'):
                 self.oldMusicPlayer = oldMusicPlayer
 
             @discord.ui.button(style=discord.ButtonStyle.gray, label='Keep')
+            @deferred(thinking=False)
             async def keep(self, interaction: discord.Interaction, button: discord.ui.Button):
                 await self.interaction.edit_original_response(content='Player creation cancelled.', view=None)
 
             @discord.ui.button(style=discord.ButtonStyle.danger, label='Move')
+            @deferred(thinking=False)
             async def move(self, interaction: discord.Interaction, button: discord.ui.Button):
                 await self.interaction.edit_original_response(content=f'Moving the player from <#{self.oldPlayerMessage.channel.id}> to {self.destinationChannel.mention}...', view=None)
 
@@ -425,6 +801,8 @@ class MusicCog(commands.GroupCog, name='music'):
                 await make_player(self.destinationChannel, self.session)
 
                 await session.commit()
+                # make_player replaced the cached state of this process, only the other processes drop theirs
+                await cog.state.publish(self.destinationChannel.guild.id, 'player_message')
 
                 await self.interaction.edit_original_response(content=f'Player moved from <#{self.oldPlayerMessage.channel.id}> to {self.destinationChannel.mention}!', view=None)
 
@@ -432,10 +810,10 @@ class MusicCog(commands.GroupCog, name='music'):
             if isinstance(interaction.channel, discord.TextChannel):
                 channel = interaction.channel
             else: 
-                await interaction.response.send_message('The channel could not be determined from the context. You can prevent this by specifying a channel when running this command.', ephemeral=True)
+                await interaction.edit_original_response(content='The channel could not be determined from the context. You can prevent this by specifying a channel when running this command.')
                 return
 
-        await interaction.response.send_message(f'Creating a music player in {channel.mention}...', ephemeral=True)
+        await interaction.edit_original_response(content=f'Creating a music player in {channel.mention}...')
 
         async with AsyncEngineManager.get_session() as session:
             existingMusicPlayer = await session.get(MusicPlayer, interaction.guild_id)
@@ -444,6 +822,7 @@ class MusicCog(commands.GroupCog, name='music'):
             if not existingMusicPlayer:
                 await make_player(channel, session)
                 await session.commit()
+                await self.state.publish(channel.guild.id, 'player_message')
                 return
 
             # Try to get the guild from the interaction
@@ -483,92 +862,115 @@ class MusicCog(commands.GroupCog, name='music'):
             await make_player(channel, session)
 
             await session.commit()
+            await self.state.publish(channel.guild.id, 'player_message')
 
         await interaction.edit_original_response(content=f'Player created in {channel.mention}!')
 
     @app_commands.command(name='quick-play', description='Adds an audio to the end of the queue.')
+    @deferred()
+    @admitted(cost=2, policy='reject')
     async def quick_play(self, interaction: discord.Interaction, url_or_search: str):
-        player = await self.join_vc(interaction=interaction, edit_response=True)
+        player = await self.run_in_guild(interaction.guild_id, self.join_vc, interaction=interaction, edit_response=True)
         if not player:
             return
 
+        # Playback is started by add_audio_to_queue once the guild's mailbox is drained
         await self.add_audio_to_queue(interaction, url_or_search)
 
-        if not player.playing:
-            await player.play(player.queue.get())
-
     @app_commands.command(name='pause', description='Pauses the current audio.')
+    @deferred()
+    @admitted()
     async def pause(self, interaction: discord.Interaction):
-        await interaction.response.send_message('Pausing the audio...', ephemeral=True)
         guild = interaction.guild
         if not guild:
             await interaction.edit_original_response(content='Could not determine the guild from the interaction. If the issue persists check how to open an issue in the bot\'s about me.')
             self.logger.error('Could not determine the guild from the interaction. Likely a network issue as I see no other way of how it would happen.')
             return
 
-        player = wavelink.Pool.get_node().get_player(guild.id)
-        if not player or not player.playing:
+        async def pause_player() -> bool:
+            player = wavelink.Pool.get_node().get_player(guild.id)
+            if not player or not player.playing:
+                return False
+
+            await player.pause(True)
+            self.request_player_update(guild)
+            return True
+
+        if not await self.actor.run(guild.id, pause_player):
             await interaction.edit_original_response(content='There is no audio playing.')
             return
 
-        await player.pause(True)
-
         await interaction.edit_original_response(content='Paused the audio!')
 
     @app_commands.command(name='resume', description='Resumes the current audio.')
+    @deferred()
+    @admitted()
     async def resume(self, interaction: discord.Interaction):
-        await interaction.response.send_message('Resuming the audio...', ephemeral=True)
         guild = interaction.guild
         if not guild:
             await interaction.edit_original_response(content='Could not determine the guild from the interaction. If the issue persists check how to open an issue in the bot\'s about me.')
             self.logger.error('Could not determine the guild from the interaction. Likely a network issue as I see no other way of how it would happen.')
             return
 
-        player = wavelink.Pool.get_node().get_player(guild.id)
-        if not player or not player.paused:
+        async def resume_player() -> bool:
+            player = wavelink.Pool.get_node().get_player(guild.id)
+            if not player or not player.paused:
+                return False
+
+            await player.pause(False)
+            self.request_player_update(guild)
+            return True
+
+        if not await self.actor.run(guild.id, resume_player):
             await interaction.edit_original_response(content='There is no audio paused.')
             return
 
-        await player.pause(False)
-
         await interaction.edit_original_response(content='Resumed the audio!')
 
     @app_commands.command(name='skip', description='Skips the current audio.')
+    @deferred()
+    @admitted()
     async def skip(self, interaction: discord.Interaction):
-        await interaction.response.send_message('Skipping the audio...', ephemeral=True)
         guild = interaction.guild
         if not guild:
             await interaction.edit_original_response(content='Could not determine the guild from the interaction. If the issue persists check how to open an issue in the bot\'s about me.')
             self.logger.error('Could not determine the guild from the interaction. Likely a network issue as I see no other way of how it would happen.')
             return
 
-        player = wavelink.Pool.get_node().get_player(guild.id)
-        if not player or not player.playing:
+        async def skip_player() -> bool:
+            player = wavelink.Pool.get_node().get_player(guild.id)
+            if not player or not player.playing:
+                return False
+
+            await player.skip()
+            self.request_player_update(guild)
+            return True
+
+        if not await self.actor.run(guild.id, skip_player):
             await interaction.edit_original_response(content='There is no audio playing.')
             return
 
-        await player.skip()
-
         await interaction.edit_original_response(content='Skipped the audio!')
 
     @app_commands.command(name='join', description='Joins the specified discord call')
+    @deferred()
+    @admitted()
     async def join(self, interaction: discord.Interaction, channel: discord.VoiceChannel):
-        await interaction.response.send_message(f'Joining {channel.mention}...', ephemeral=True)
-        
-        await self.join_vc(channel=channel, edit_response=True, force=True)
-
-        await interaction.edit_original_response(content=f'Successfully joined {channel.mention}!')
+        player = await self.actor.run(channel.guild.id, self.join_vc, interaction=interaction, channel=channel, edit_response=True, force=True)
+        # Otherwise join_vc already told the user why it could not join
+        if player:
+            await interaction.edit_original_response(content=f'Successfully joined {channel.mention}!')
 
     @app_commands.command(name='leave', description='Leaves the current discord call')
+    @deferred()
+    @admitted()
     async def leave(self, interaction: discord.Interaction):
-        await interaction.response.send_message('Leaving the voice channel...', ephemeral=True)
-
         if not interaction.guild:
             await interaction.edit_original_response(content='Could not determine the guild from the interaction. If the issue persists check how to open an issue in the bot\'s about me.')
             self.logger.error('Could not determine the guild from the interaction. Likely a network issue as I see no other way of how it would happen.')
             return
 
-        await self.leave_vc(interaction.guild)
+        await self.actor.run(interaction.guild.id, self.leave_vc, interaction.guild)
 
         await interaction.edit_original_response(content='Left the voice channel!')
 
@@ -1,24 +1,129 @@
+import importlib.util
 import logging
 from dotenv import load_dotenv
 import os
 
-load_dotenv()
+from typing import Any, Callable, List
 
-def get_env_variable(var_name):
+_env_loaded = False
+
+def load_env() -> None:
+    """Loads the .env file, once. Deferred until a setting is first read so importing the config stays cheap."""
+    global _env_loaded
+    if not _env_loaded:
+        _env_loaded = True
+        load_dotenv()
+
+def get_env_variable(var_name, default=None):
+    load_env()
     try:
         return os.environ[var_name]
     except KeyError:
+        if default is not None:
+            return default
         error_msg = f'Set the {var_name} environment variable'
         raise KeyError(error_msg)
 
-DISCORD_AUTH_TOKEN = get_env_variable("DISCORD_AUTH_TOKEN")
-
 BOT_PREFIX = '+'
 
-DATABASE_URL = get_env_variable("DATABASE_URL").replace("postgresql://", "postgresql+asyncpg://")
-DATABASE_URL_SYNC = get_env_variable("DATABASE_URL").replace("postgresql://", "postgresql+psycopg2://")
+# Driver modules behind the async and sync url of each supported database
+DATABASE_DRIVERS = {
+    'postgresql': ('asyncpg', 'psycopg2'),
+    'sqlite': ('aiosqlite', 'sqlite3'),
+}
+
+def get_database_scheme(url: str) -> str:
+    """Returns the database of the url without its driver, e.g. postgresql for postgresql+asyncpg://..."""
+    return url.split('://', 1)[0].split('+', 1)[0]
+
+def get_database_urls(url: str) -> tuple[str, str]:
+    """
+    Returns the async and sync SQLAlchemy URLs for the database url.
+    postgresql:// urls run on asyncpg/psycopg2, sqlite:// urls (e.g. sqlite:///bot.db) on aiosqlite/sqlite3.
+    """
+    # Urls naming a driver already (e.g. sqlite+aiosqlite://) are rebuilt from their database as well
+    scheme, rest = get_database_scheme(url), url.partition('://')[2]
+    if scheme == "sqlite":
+        return f'sqlite+aiosqlite://{rest}', f'sqlite://{rest}'
+    return f'{scheme}+asyncpg://{rest}', f'{scheme}+psycopg2://{rest}'
+
+# Every setting is read from the environment when it is first accessed (see __getattr__ below) rather than on import,
+# so `run.py --check` and alembic only pay for, and only fail on, the settings they use.
+_SETTINGS: dict[str, Callable[[], Any]] = {
+    "DISCORD_AUTH_TOKEN": lambda: get_env_variable("DISCORD_AUTH_TOKEN"),
+
+    "DATABASE_URL": lambda: get_database_urls(get_env_variable("DATABASE_URL"))[0],
+    "DATABASE_URL_SYNC": lambda: get_database_urls(get_env_variable("DATABASE_URL"))[1],
+
+    "LAVALINK_HOST": lambda: get_env_variable("LAVALINK_HOST"),
+
+    # Bulk role assignment, requests per second and requests in flight
+    "BULK_ROLE_RATE": lambda: float(get_env_variable("BULK_ROLE_RATE", "5")),
+    "BULK_ROLE_CONCURRENCY": lambda: int(get_env_variable("BULK_ROLE_CONCURRENCY", "4")),
+
+    # Per guild in-memory state, evicted least recently used first over the budget (in MiB) or after the idle timeout (in seconds)
+    "GUILD_STATE_BUDGET": lambda: int(float(get_env_variable("GUILD_STATE_BUDGET_MB", "16")) * 1024 * 1024),
+    "GUILD_IDLE_TIMEOUT": lambda: float(get_env_variable("GUILD_IDLE_TIMEOUT", "600")),
+
+    # Search sources in order of preference, how long each may take and how long to wait before also asking the next one,
+    # until a source has enough samples to wait for its p95 latency instead
+    "SEARCH_SOURCES": lambda: [source.strip() for source in get_env_variable("SEARCH_SOURCES", "ytmsearch,ytsearch,scsearch").split(",") if source.strip()],
+    "SEARCH_TIMEOUT": lambda: float(get_env_variable("SEARCH_TIMEOUT", "5")),
+    "SEARCH_HEDGE_DELAY": lambda: float(get_env_variable("SEARCH_HEDGE_DELAY", "1.5")),
+
+    # Admission control in front of the music commands, sustained requests per second and burst per user, guild and overall
+    "ADMISSION_USER_RATE": lambda: float(get_env_variable("ADMISSION_USER_RATE", "1")),
+    "ADMISSION_USER_BURST": lambda: float(get_env_variable("ADMISSION_USER_BURST", "5")),
+    "ADMISSION_GUILD_RATE": lambda: float(get_env_variable("ADMISSION_GUILD_RATE", "3")),
+    "ADMISSION_GUILD_BURST": lambda: float(get_env_variable("ADMISSION_GUILD_BURST", "10")),
+    "ADMISSION_GLOBAL_RATE": lambda: float(get_env_variable("ADMISSION_GLOBAL_RATE", "30")),
+    "ADMISSION_GLOBAL_BURST": lambda: float(get_env_variable("ADMISSION_GLOBAL_BURST", "60")),
+    # Longest a queued command waits for its turn before it is shed, in seconds
+    "ADMISSION_MAX_WAIT": lambda: float(get_env_variable("ADMISSION_MAX_WAIT", "2")),
+
+    # Where /debug profile writes its profiles
+    "PROFILE_DIR": lambda: get_env_variable("PROFILE_DIR", "profiles"),
+}
+
+def __getattr__(name: str) -> Any:
+    if name not in _SETTINGS:
+        raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+    value = _SETTINGS[name]()
+    # Cached as a regular module attribute, __getattr__ is not called for it again
+    globals()[name] = value
+    return value
+
+def check_config() -> List[str]:
+    """
+    Reads every setting and checks the database url without importing discord, wavelink or SQLAlchemy.
+
+    Returns:
+        List[str]: The problems found, empty if the config is valid.
+    """
+    load_env()
+    problems = []
+    for name, read in _SETTINGS.items():
+        try:
+            read()
+        except KeyError as error:
+            problems.append(error.args[0])
+        except ValueError as error:
+            problems.append(f'{name}: {error}')
+
+    url = os.environ.get("DATABASE_URL")
+    if url:
+        scheme = get_database_scheme(url)
+        if scheme not in DATABASE_DRIVERS:
+            problems.append(f'DATABASE_URL: unsupported database "{scheme}", use one of {", ".join(DATABASE_DRIVERS)}')
+        else:
+            for driver in DATABASE_DRIVERS[scheme]:
+                if importlib.util.find_spec(driver) is None:
+                    problems.append(f'DATABASE_URL: the {driver} driver is not installed')
 
-LAVALINK_HOST = get_env_variable("LAVALINK_HOST")
+    if not _SETTINGS["SEARCH_SOURCES"]():
+        problems.append('SEARCH_SOURCES: no search source set')
+    # DATABASE_URL and DATABASE_URL_SYNC come from the same variable, report it once
+    return list(dict.fromkeys(problems))
 
 def setup_logging():
     levelname = "[ {levelname} ]"
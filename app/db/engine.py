@@ -1,22 +1,47 @@
-from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine, async_sessionmaker
-from app.config import DATABASE_URL
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, create_async_engine, async_sessionmaker
+
+# Applied to every new SQLite connection. WAL lets readers run alongside the writer and NORMAL sync is durable enough with WAL.
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'foreign_keys': 'ON',
+    'busy_timeout': 5000,
+    'cache_size': -16000, # 16 MiB
+    'temp_store': 'MEMORY',
+    'mmap_size': 64 * 1024 * 1024,
+}
+
+def set_sqlite_pragmas(dbapi_connection, connection_record) -> None:
+    cursor = dbapi_connection.cursor()
+    for name, value in SQLITE_PRAGMAS.items():
+        cursor.execute(f'PRAGMA {name}={value}')
+    cursor.close()
 
 class AsyncEngineManager:
     _engine: AsyncEngine | None = None
+    _sessionmaker: async_sessionmaker[AsyncSession] | None = None
 
     @classmethod
     def get_engine(cls) -> AsyncEngine:
         if cls._engine is None:
+            # Read on first use, importing the engine (e.g. from alembic for the pragmas) doesn't need the database configured
+            from app.config import DATABASE_URL
             cls._engine = create_async_engine(DATABASE_URL, echo=False)
+            if make_url(DATABASE_URL).get_backend_name() == 'sqlite':
+                event.listen(cls._engine.sync_engine, 'connect', set_sqlite_pragmas)
         return cls._engine
 
     @classmethod
-    def get_session(cls):
-        async_session = async_sessionmaker(cls.get_engine(), expire_on_commit=False)
-        return async_session()
+    def get_session(cls) -> AsyncSession:
+        if cls._sessionmaker is None:
+            cls._sessionmaker = async_sessionmaker(cls.get_engine(), expire_on_commit=False)
+        return cls._sessionmaker()
 
     @classmethod
     async def close(cls):
         if cls._engine is not None:
             await cls._engine.dispose()
             cls._engine = None
+            cls._sessionmaker = None
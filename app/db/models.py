@@ -1,6 +1,8 @@
 from __future__ import annotations
 
-from sqlalchemy import BigInteger, ForeignKey
+from datetime import datetime
+
+from sqlalchemy import BigInteger, DateTime, ForeignKey, Text
 from sqlalchemy.ext.asyncio import AsyncAttrs
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship
 
@@ -31,3 +33,21 @@ class MusicPlayerQueueItem(Base):
     duration: Mapped[int] = mapped_column()
     thumbnail: Mapped[str] = mapped_column()
 
+class BulkRoleJob(Base):
+    __tablename__ = 'bulk_role_jobs'
+
+    guild_id: Mapped[int] = mapped_column(BigInteger, primary_key=True)
+    role_id: Mapped[int] = mapped_column(BigInteger)
+    action: Mapped[str] = mapped_column()
+
+    # Comma separated, sorted member ids, `cursor` of them have already been processed
+    member_ids: Mapped[str] = mapped_column(Text)
+    cursor: Mapped[int] = mapped_column(default=0)
+    failed: Mapped[int] = mapped_column(default=0)
+
+class GuildLease(Base):
+    __tablename__ = 'guild_leases'
+
+    guild_id: Mapped[int] = mapped_column(BigInteger, primary_key=True)
+    owner: Mapped[str] = mapped_column()
+    expires_at: Mapped[datetime] = mapped_column(DateTime(timezone=True))
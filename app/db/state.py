@@ -0,0 +1,296 @@
+import asyncio
+import json
+from abc import ABC, abstractmethod
+import logging
+import os
+import socket
+import time
+import uuid
+from datetime import timedelta
+from typing import Any, Awaitable, Callable, Optional, Union
+
+from sqlalchemy import delete, func, select, text
+from sqlalchemy.dialects.postgresql import insert
+
+from app.db.engine import AsyncEngineManager
+from app.db.models import GuildLease
+
+# Called with the guild id and the kind of the invalidation
+InvalidationCallback = Callable[[int, str], Union[Awaitable[None], None]]
+
+NOTIFY_CHANNEL = 'dtc_state'
+
+def make_owner_id() -> str:
+    return f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+
+class StateBackend(ABC):
+    """
+    Coordinates per guild state between several processes of the bot.
+
+    A guild's player is owned by the process holding the guild's lease, leases expire after `lease_ttl` seconds
+    unless renewed, which the backend does on its own for every lease it holds. Invalidations are broadcast
+    to every other process so they can drop their cached state of the guild.
+
+    Parameters:
+        owner_id (Optional[str]): Identifies this process, generated if not passed.
+        lease_ttl (float): Seconds a lease stays valid without being renewed.
+    """
+    def __init__(self, owner_id: Optional[str] = None, lease_ttl: float = 30):
+        self.owner_id = owner_id or make_owner_id()
+        self.lease_ttl = lease_ttl
+        self.held_leases: set[int] = set()
+        # guild id: time.monotonic() of the last successful acquisition or renewal of the lease
+        self.renewed_at: dict[int, float] = {}
+        # Tells whether the process still needs the guild, e.g. still plays in it. Leases of guilds it doesn't are released instead of renewed
+        self.lease_needed: Callable[[int], bool] = lambda guild_id: True
+        self.subscribers: list[InvalidationCallback] = []
+        self.logger = logging.getLogger('bot')
+        self._renew_task: Optional[asyncio.Task] = None
+
+    async def start(self) -> None:
+        self._renew_task = asyncio.create_task(self._renew_leases())
+
+    async def close(self) -> None:
+        if self._renew_task:
+            self._renew_task.cancel()
+        for guild_id in list(self.held_leases):
+            await self.release_lease(guild_id)
+
+    def subscribe(self, callback: InvalidationCallback) -> None:
+        self.subscribers.append(callback)
+
+    def holds_lease(self, guild_id: int) -> bool:
+        return guild_id in self.held_leases
+
+    async def may_own(self, guild_id: int) -> bool:
+        """Whether this process holds the lease of the guild or nobody does."""
+        if guild_id in self.held_leases:
+            return True
+        return await self.lease_owner(guild_id) in (None, self.owner_id)
+
+    @abstractmethod
+    async def acquire_lease(self, guild_id: int) -> bool:
+        """Acquires or renews the lease of the guild, returns False if another process holds it."""
+
+    @abstractmethod
+    async def release_lease(self, guild_id: int) -> None:
+        pass
+
+    @abstractmethod
+    async def lease_owner(self, guild_id: int) -> Optional[str]:
+        pass
+
+    @abstractmethod
+    async def publish(self, guild_id: int, kind: str) -> None:
+        """Tells every other process to drop its `kind` state of the guild."""
+
+    def _lease_acquired(self, guild_id: int, acquired: bool) -> None:
+        if acquired:
+            self.held_leases.add(guild_id)
+            self.renewed_at[guild_id] = time.monotonic()
+        else:
+            self._lease_lost(guild_id)
+
+    def _lease_lost(self, guild_id: int) -> None:
+        self.held_leases.discard(guild_id)
+        self.renewed_at.pop(guild_id, None)
+
+    async def _dispatch(self, guild_id: int, kind: str) -> None:
+        for callback in self.subscribers:
+            try:
+                result = callback(guild_id, kind)
+                if asyncio.iscoroutine(result):
+                    await result
+            except Exception:
+                self.logger.exception(f'State invalidation handler failed for the guild(id: {guild_id}).')
+
+    async def _renew_leases(self) -> None:
+        while True:
+            await asyncio.sleep(self.lease_ttl / 3)
+            for guild_id in list(self.held_leases):
+                try:
+                    if not self.lease_needed(guild_id):
+                        # The player went away without releasing the guild, e.g. the bot was kicked from the voice channel
+                        self.logger.info(f'Released the lease of the guild(id: {guild_id}), nothing runs in it anymore.')
+                        await self.release_lease(guild_id)
+                        continue
+                    if not await self.acquire_lease(guild_id):
+                        self.logger.warning(f'Lost the lease of the guild(id: {guild_id}) to another process.')
+                except Exception:
+                    self.logger.exception(f'Could not renew the lease of the guild(id: {guild_id}).')
+                    # Past its ttl the lease may belong to another process by now, stop acting as its owner
+                    if time.monotonic() - self.renewed_at.get(guild_id, 0) >= self.lease_ttl:
+                        self.logger.warning(f'The lease of the guild(id: {guild_id}) expired without being renewed, dropped it.')
+                        self._lease_lost(guild_id)
+
+class InMemoryStateHub:
+    """Shared by InMemoryStateBackends that should see each other's leases and invalidations, e.g. in tests."""
+    def __init__(self):
+        self.leases: dict[int, tuple[str, float]] = {}
+        self.backends: list['InMemoryStateBackend'] = []
+
+class InMemoryStateBackend(StateBackend):
+    """
+    Stand-in for PostgresStateBackend when the bot runs as a single process, and for tests.
+    Backends created with the same hub behave like separate processes sharing a database.
+    """
+    def __init__(self, hub: Optional[InMemoryStateHub] = None, owner_id: Optional[str] = None, lease_ttl: float = 30):
+        super().__init__(owner_id=owner_id, lease_ttl=lease_ttl)
+        self.hub = hub or InMemoryStateHub()
+        self.hub.backends.append(self)
+
+    async def close(self) -> None:
+        await super().close()
+        if self in self.hub.backends:
+            self.hub.backends.remove(self)
+
+    async def acquire_lease(self, guild_id: int) -> bool:
+        now = time.monotonic()
+        lease = self.hub.leases.get(guild_id)
+        if lease and lease[0] != self.owner_id and lease[1] > now:
+            self._lease_acquired(guild_id, False)
+            return False
+        self.hub.leases[guild_id] = (self.owner_id, now + self.lease_ttl)
+        self._lease_acquired(guild_id, True)
+        return True
+
+    async def release_lease(self, guild_id: int) -> None:
+        self._lease_lost(guild_id)
+        lease = self.hub.leases.get(guild_id)
+        if lease and lease[0] == self.owner_id:
+            del self.hub.leases[guild_id]
+
+    async def lease_owner(self, guild_id: int) -> Optional[str]:
+        lease = self.hub.leases.get(guild_id)
+        if not lease or lease[1] <= time.monotonic():
+            return None
+        return lease[0]
+
+    async def publish(self, guild_id: int, kind: str) -> None:
+        for backend in list(self.hub.backends):
+            if backend is not self:
+                await backend._dispatch(guild_id, kind)
+
+class PostgresStateBackend(StateBackend):
+    """
+    Keeps the leases in the guild_leases table and broadcasts invalidations with LISTEN/NOTIFY,
+    on top of the bot's asyncpg engine. Lease expiry uses the database clock, so the clocks of the hosts don't matter.
+    """
+    def __init__(self, owner_id: Optional[str] = None, lease_ttl: float = 30):
+        super().__init__(owner_id=owner_id, lease_ttl=lease_ttl)
+        self._listen_connection: Any = None
+        self._driver_connection: Any = None
+        self._closed = False
+
+    async def start(self) -> None:
+        await super().start()
+        # Goes through the retry loop, a database that is down at boot must not leave the process deaf to invalidations
+        await self._reconnect()
+
+    async def close(self) -> None:
+        self._closed = True
+        await super().close()
+        await self._close_listen_connection()
+
+    async def _listen(self) -> None:
+        # LISTEN needs a connection of its own which stays checked out for as long as the bot runs
+        self._listen_connection = await AsyncEngineManager.get_engine().connect()
+        try:
+            raw_connection = await self._listen_connection.get_raw_connection()
+            self._driver_connection = raw_connection.driver_connection
+            await self._driver_connection.add_listener(NOTIFY_CHANNEL, self._on_notification)
+            self._driver_connection.add_termination_listener(self._on_connection_lost)
+        except Exception:
+            # Don't keep a half set up connection checked out while retrying
+            await self._close_listen_connection()
+            raise
+        self.logger.info(f'Listening for state invalidations as {self.owner_id}.')
+
+    async def _close_listen_connection(self) -> None:
+        """
+        Detaches the listeners and throws the listen connection away. Returned to the pool as is it would keep LISTENing
+        and calling into this backend while being reused for regular queries.
+        """
+        connection, driver_connection = self._listen_connection, self._driver_connection
+        self._listen_connection = self._driver_connection = None
+        if driver_connection is not None:
+            driver_connection.remove_termination_listener(self._on_connection_lost)
+            try:
+                await driver_connection.remove_listener(NOTIFY_CHANNEL, self._on_notification)
+            except Exception:
+                # A dead connection can't UNLISTEN, it is invalidated below anyway
+                pass
+        if connection is not None:
+            await connection.invalidate()
+            await connection.close()
+
+    def _on_connection_lost(self, connection: Any) -> None:
+        if self._closed:
+            return
+        self.logger.warning('Lost the state invalidation connection, reconnecting.')
+        asyncio.create_task(self._reconnect())
+
+    async def _reconnect(self) -> None:
+        while not self._closed:
+            try:
+                await self._close_listen_connection()
+                await self._listen()
+                return
+            except Exception:
+                self.logger.exception('Could not reconnect the state invalidation connection, retrying in 5s.')
+                await asyncio.sleep(5)
+
+    def _on_notification(self, connection: Any, pid: int, channel: str, payload: str) -> None:
+        if self._closed:
+            return
+        try:
+            message = json.loads(payload)
+        except json.JSONDecodeError:
+            self.logger.warning(f'Ignoring malformed state invalidation: {payload}')
+            return
+        if message.get('origin') == self.owner_id:
+            return
+        asyncio.create_task(self._dispatch(int(message['guild_id']), message['kind']))
+
+    async def acquire_lease(self, guild_id: int) -> bool:
+        statement = insert(GuildLease).values(
+                guild_id=guild_id,
+                owner=self.owner_id,
+                expires_at=func.now() + timedelta(seconds=self.lease_ttl)
+                )
+        statement = statement.on_conflict_do_update(
+                index_elements=[GuildLease.guild_id],
+                set_={'owner': statement.excluded.owner, 'expires_at': statement.excluded.expires_at},
+                where=(GuildLease.owner == statement.excluded.owner) | (GuildLease.expires_at < func.now())
+                ).returning(GuildLease.owner)
+
+        async with AsyncEngineManager.get_session() as session:
+            acquired = (await session.execute(statement)).scalar_one_or_none() == self.owner_id
+            await session.commit()
+
+        self._lease_acquired(guild_id, acquired)
+        return acquired
+
+    async def release_lease(self, guild_id: int) -> None:
+        self._lease_lost(guild_id)
+        async with AsyncEngineManager.get_session() as session:
+            await session.execute(delete(GuildLease).where(GuildLease.guild_id == guild_id, GuildLease.owner == self.owner_id))
+            await session.commit()
+
+    async def lease_owner(self, guild_id: int) -> Optional[str]:
+        async with AsyncEngineManager.get_session() as session:
+            return (await session.execute(
+                select(GuildLease.owner).where(GuildLease.guild_id == guild_id, GuildLease.expires_at > func.now())
+                )).scalar_one_or_none()
+
+    async def publish(self, guild_id: int, kind: str) -> None:
+        payload = json.dumps({'guild_id': guild_id, 'kind': kind, 'origin': self.owner_id})
+        async with AsyncEngineManager.get_session() as session:
+            await session.execute(text('SELECT pg_notify(:channel, :payload)'), {'channel': NOTIFY_CHANNEL, 'payload': payload})
+            await session.commit()
+
+def create_state_backend() -> StateBackend:
+    """Picks the state backend matching the configured database."""
+    if AsyncEngineManager.get_engine().dialect.name == 'postgresql':
+        return PostgresStateBackend()
+    return InMemoryStateBackend()
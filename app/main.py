@@ -1,20 +1,44 @@
+import asyncio
+import importlib
 import os
 import logging
 import discord
+from discord import app_commands
 from discord.ext import commands
 
-from app.config import setup_logging, BOT_PREFIX, DISCORD_AUTH_TOKEN
+from app import config
+from app.config import setup_logging, BOT_PREFIX
+from app.utils.interactions import deferred
+from app.utils.startup import startup
+
+# What the cogs pull in, the Lavalink and database stacks. Imported in a worker thread while the gateway connects
+# instead of on the event loop once it is ready, the cogs are only loaded after the preload finished.
+PRELOADED_MODULES = ['wavelink', 'app.db.state', 'app.music.queue', 'app.music.search']
+
+def preload_modules(modules: list[str]) -> None:
+    logger = logging.getLogger('bot')
+    for module in modules:
+        try:
+            with startup.timed(f'preload {module}'):
+                importlib.import_module(module)
+        except Exception as error:
+            # Loading the cog which needs it raises the error again, with the cog's context
+            logger.warning(f'Could not preload {module}: {error}')
 
 def main(debug: bool = False):
     setup_logging()
     logger = logging.getLogger('bot')
     intents = discord.Intents.all()
     bot = commands.Bot(command_prefix=BOT_PREFIX, intents=intents)
+    preload_task: asyncio.Task | None = None
 
     async def load_cogs():
+        if preload_task:
+            await preload_task
         for filename in os.listdir('./app/cogs'):
             if filename.endswith('.py'):
-                await bot.load_extension(f'app.cogs.{filename[:-3]}')
+                with startup.timed(f'load cog {filename[:-3]}'):
+                    await bot.load_extension(f'app.cogs.{filename[:-3]}')
                 logger.info(f'Loaded cog: {filename[:-3]}')
 
     async def unload_cogs():
@@ -23,13 +47,37 @@ def main(debug: bool = False):
                 await bot.unload_extension(f'app.cogs.{filename[:-3]}')
                 logger.info(f'Unloaded cog: {filename[:-3]}')
 
+    async def setup_hook():
+        nonlocal preload_task
+        modules = list(PRELOADED_MODULES)
+        database_driver = config.DATABASE_DRIVERS.get(config.get_database_scheme(config.get_env_variable('DATABASE_URL')))
+        if database_driver:
+            modules.append(database_driver[0])
+        preload_task = asyncio.create_task(asyncio.to_thread(preload_modules, modules))
+
+    bot.setup_hook = setup_hook
+
     @bot.event
     async def on_ready():
         logger.info(f'Logged in as {bot.user.name} ID: {bot.user.id}') # pyright: ignore[reportOptionalMemberAccess]
 
+        # on_ready fires again after every reconnect, the cogs are only loaded the first time
+        ready_after = startup.mark('gateway ready')
+        if ready_after is None:
+            return
+        logger.info(f'Gateway ready {ready_after:.2f}s after start')
+
         await load_cogs()
+        startup.mark('cogs loaded')
 
-        await bot.tree.sync()
+        with startup.timed('command tree sync'):
+            await bot.tree.sync()
+        startup.mark('commands synced')
+
+    @bot.event
+    async def on_app_command_completion(interaction: discord.Interaction, command: app_commands.Command | app_commands.ContextMenu):
+        if startup.mark('first command served') is not None:
+            startup.log()
 
     @bot.event
     async def on_close():
@@ -41,14 +89,14 @@ def main(debug: bool = False):
 
     @bot.tree.command(name='reload', description='Reloads all cogs')
     @commands.is_owner()
+    @deferred()
     async def reload_cogs(interaction: discord.Interaction):
-        await interaction.response.send_message('Reloading all cogs...', ephemeral=True)
         await unload_cogs()
         await load_cogs()
         await interaction.edit_original_response(content='Reloaded all cogs!')
 
     try:
-        bot.run(DISCORD_AUTH_TOKEN, log_handler=None)
+        bot.run(config.DISCORD_AUTH_TOKEN, log_handler=None)
     except (SystemExit, KeyboardInterrupt):
         bot.loop.run_until_complete(bot.close())
         logger.info('Bot closed successfully')
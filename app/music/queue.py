@@ -0,0 +1,320 @@
+import itertools
+import random
+from typing import Any, Iterable, Iterator, List, Optional
+
+import wavelink
+
+class _Node:
+    __slots__ = ('value', 'entry_id', 'priority', 'size', 'left', 'right', 'parent')
+
+    def __init__(self, value: Any, entry_id: int):
+        self.value = value
+        self.entry_id = entry_id
+        self.priority = random.random()
+        self.size = 1
+        self.left: Optional[_Node] = None
+        self.right: Optional[_Node] = None
+        self.parent: Optional[_Node] = None
+
+def _size(node: Optional[_Node]) -> int:
+    return node.size if node else 0
+
+def _update(node: _Node) -> None:
+    node.size = 1 + _size(node.left) + _size(node.right)
+    if node.left:
+        node.left.parent = node
+    if node.right:
+        node.right.parent = node
+
+def _split(node: Optional[_Node], k: int) -> tuple[Optional[_Node], Optional[_Node]]:
+    """Splits the tree into the first `k` entries and the rest. The returned roots may still point to their old parent."""
+    if not node:
+        return None, None
+    if _size(node.left) >= k:
+        left, node.left = _split(node.left, k)
+        _update(node)
+        return left, node
+    node.right, right = _split(node.right, k - _size(node.left) - 1)
+    _update(node)
+    return node, right
+
+def _merge(left: Optional[_Node], right: Optional[_Node]) -> Optional[_Node]:
+    if not left:
+        return right
+    if not right:
+        return left
+    if left.priority > right.priority:
+        left.right = _merge(left.right, right)
+        _update(left)
+        return left
+    right.left = _merge(left, right.left)
+    _update(right)
+    return right
+
+def _build(nodes: List[_Node]) -> Optional[_Node]:
+    """Builds a treap with the nodes in the given order in O(n), using the priorities they already have."""
+    stack: List[_Node] = []
+    for node in nodes:
+        node.left = node.right = node.parent = None
+        last: Optional[_Node] = None
+        while stack and stack[-1].priority < node.priority:
+            last = stack.pop()
+        node.left = last
+        if stack:
+            stack[-1].right = node
+        stack.append(node)
+
+    if not stack:
+        return None
+
+    # Sizes and parents bottom up, iterative since a skewed build could be deep
+    root = stack[0]
+    order: List[_Node] = []
+    pending = [root]
+    while pending:
+        node = pending.pop()
+        order.append(node)
+        if node.left:
+            pending.append(node.left)
+        if node.right:
+            pending.append(node.right)
+    for node in reversed(order):
+        _update(node)
+    root.parent = None
+    return root
+
+class IndexedList:
+    """
+    A list-like sequence backed by an implicit treap.
+
+    Positional access, insertion, removal and moves are O(log n) instead of the O(n) of a list,
+    appending many items at once is O(k + log n) and shuffling is O(n).
+    Every entry gets an id which stays the same while the entry is moved around,
+    looking an entry up by its id is O(1) and finding its position O(log n).
+
+    Parameters:
+        items (Iterable): The initial items.
+    """
+    def __init__(self, items: Iterable[Any] = ()):
+        self._root: Optional[_Node] = None
+        self._entries: dict[int, _Node] = {}
+        self._next_id = itertools.count(1)
+        self.extend(items)
+
+    def _new_node(self, value: Any) -> _Node:
+        node = _Node(value, next(self._next_id))
+        self._entries[node.entry_id] = node
+        return node
+
+    def _set_root(self, root: Optional[_Node]) -> None:
+        self._root = root
+        if root:
+            root.parent = None
+
+    def _normalize_index(self, index: int) -> int:
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('IndexedList index out of range')
+        return index
+
+    def _node_at(self, index: int) -> _Node:
+        index = self._normalize_index(index)
+        node = self._root
+        while node:
+            left_size = _size(node.left)
+            if index < left_size:
+                node = node.left
+            elif index == left_size:
+                return node
+            else:
+                index -= left_size + 1
+                node = node.right
+        raise IndexError('IndexedList index out of range')
+
+    def _position_of(self, node: _Node) -> int:
+        position = _size(node.left)
+        while node.parent:
+            if node is node.parent.right:
+                position += _size(node.parent.left) + 1
+            node = node.parent
+        return position
+
+    def _insert_node(self, index: int, node: _Node) -> None:
+        left, right = _split(self._root, index)
+        self._set_root(_merge(_merge(left, node), right))
+
+    def _detach_node(self, index: int) -> _Node:
+        index = self._normalize_index(index)
+        left, right = _split(self._root, index)
+        node, right = _split(right, 1)
+        self._set_root(_merge(left, right))
+        assert node is not None
+        node.parent = None
+        return node
+
+    def __len__(self) -> int:
+        return _size(self._root)
+
+    def __bool__(self) -> bool:
+        return self._root is not None
+
+    def __iter__(self) -> Iterator[Any]:
+        return (node.value for node in self._iter_nodes(self._root))
+
+    def __reversed__(self) -> Iterator[Any]:
+        stack: List[_Node] = []
+        node = self._root
+        while stack or node:
+            while node:
+                stack.append(node)
+                node = node.right
+            node = stack.pop()
+            yield node.value
+            node = node.left
+
+    def __contains__(self, value: Any) -> bool:
+        return any(item == value for item in self)
+
+    def __getitem__(self, index: int | slice) -> Any:
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step == 1:
+                return list(itertools.islice(self, start, max(start, stop)))
+            return list(self)[index]
+        return self._node_at(index).value
+
+    def __setitem__(self, index: int, value: Any) -> None:
+        self._node_at(index).value = value
+
+    def __delitem__(self, index: int | slice) -> None:
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step == 1:
+                left, right = _split(self._root, start)
+                middle, right = _split(right, max(0, stop - start))
+                for value_node in self._iter_nodes(middle):
+                    del self._entries[value_node.entry_id]
+                self._set_root(_merge(left, right))
+                return
+            for position in sorted(range(start, stop, step), reverse=True):
+                self.pop(position)
+            return
+        self.pop(index)
+
+    def __repr__(self) -> str:
+        return f'IndexedList({list(self)!r})'
+
+    def _iter_nodes(self, root: Optional[_Node]) -> Iterator[_Node]:
+        stack: List[_Node] = []
+        node = root
+        while stack or node:
+            while node:
+                stack.append(node)
+                node = node.left
+            node = stack.pop()
+            yield node
+            node = node.right
+
+    def append(self, value: Any) -> None:
+        self._set_root(_merge(self._root, self._new_node(value)))
+
+    def extend(self, values: Iterable[Any]) -> None:
+        self._set_root(_merge(self._root, _build([self._new_node(value) for value in values])))
+
+    def insert(self, index: int, value: Any) -> None:
+        # Same clamping as list.insert
+        length = len(self)
+        if index < 0:
+            index = max(0, index + length)
+        self._insert_node(min(index, length), self._new_node(value))
+
+    def pop(self, index: int = -1) -> Any:
+        node = self._detach_node(index)
+        del self._entries[node.entry_id]
+        return node.value
+
+    def index(self, value: Any) -> int:
+        for position, item in enumerate(self):
+            if item == value:
+                return position
+        raise ValueError(f'{value!r} is not in IndexedList')
+
+    def remove(self, value: Any) -> None:
+        self.pop(self.index(value))
+
+    def clear(self) -> None:
+        self._root = None
+        self._entries.clear()
+
+    def copy(self) -> 'IndexedList':
+        return IndexedList(self)
+
+    def move(self, source: int, destination: int) -> None:
+        """Moves the entry at `source` so it ends up at `destination`, keeping its entry id."""
+        destination = self._normalize_index(destination)
+        node = self._detach_node(source)
+        self._insert_node(destination, node)
+
+    def swap(self, first: int, second: int) -> None:
+        """Swaps two entries, their entry ids travel with them."""
+        first_node, second_node = self._node_at(first), self._node_at(second)
+        first_node.value, second_node.value = second_node.value, first_node.value
+        first_node.entry_id, second_node.entry_id = second_node.entry_id, first_node.entry_id
+        self._entries[first_node.entry_id] = first_node
+        self._entries[second_node.entry_id] = second_node
+
+    def shuffle(self) -> None:
+        """Shuffles the entries in place, their entry ids travel with them."""
+        nodes = list(self._iter_nodes(self._root))
+        random.shuffle(nodes)
+        self._set_root(_build(nodes))
+
+    def entry_id(self, index: int) -> int:
+        return self._node_at(index).entry_id
+
+    def get_entry(self, entry_id: int) -> Any:
+        """Returns the value of the entry with the given id. Raises KeyError if it is not in the list."""
+        return self._entries[entry_id].value
+
+    def index_of(self, entry_id: int) -> int:
+        """Returns the position of the entry with the given id. Raises KeyError if it is not in the list."""
+        return self._position_of(self._entries[entry_id])
+
+class IndexedQueue(wavelink.Queue):
+    """
+    A wavelink.Queue whose items live in an IndexedList, so positional operations stay fast on very long queues.
+    The history is append only and keeps the default list storage.
+    """
+    def __init__(self, *, history: bool = True) -> None:
+        super().__init__(history=history)
+        self._items: IndexedList = IndexedList() # type: ignore
+
+    def swap(self, first: int, second: int, /) -> None:
+        self._items.swap(first, second)
+
+    def move(self, source: int, destination: int, /) -> None:
+        self._items.move(source, destination)
+
+    def shuffle(self) -> None:
+        self._items.shuffle()
+
+    def copy(self) -> 'IndexedQueue':
+        copy_queue = IndexedQueue(history=self.history is not None)
+        copy_queue._items = self._items.copy()
+        return copy_queue
+
+    def entry_id(self, index: int, /) -> int:
+        return self._items.entry_id(index)
+
+    def get_entry(self, entry_id: int, /) -> wavelink.Playable:
+        return self._items.get_entry(entry_id)
+
+    def index_of(self, entry_id: int, /) -> int:
+        return self._items.index_of(entry_id)
+
+class IndexedPlayer(wavelink.Player):
+    """A wavelink.Player using an IndexedQueue."""
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.queue = IndexedQueue()
@@ -0,0 +1,132 @@
+import asyncio
+import logging
+from collections import deque
+from typing import List, Optional
+
+import wavelink
+import yarl
+
+# Latency samples a source needs before its p95 replaces the configured hedge delay
+HEDGE_MIN_SAMPLES = 20
+
+class SourceStats:
+    """Latency and outcome counters of a single search source."""
+    def __init__(self, max_samples: int = 200):
+        self.latencies: deque[float] = deque(maxlen=max_samples)
+        self.wins = 0
+        self.timeouts = 0
+        self.errors = 0
+
+    def percentile(self, percentile: float) -> Optional[float]:
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * percentile / 100))]
+
+class HedgedSearch:
+    """
+    Searches several sources for plain text queries and returns the first acceptable result.
+
+    The sources are started in order, each after the previous one had as long as its p95 latency to answer (`hedge_delay`
+    until it has enough samples) or right away when it failed, so a healthy source usually answers before the next one
+    is even asked. Every hedge is an extra search on Lavalink, which keeps running upstream even when its task is cancelled.
+    Every source is cut off after `timeout` seconds and the ones still running are cancelled once a result is accepted.
+    URLs point at a single source and are fetched directly.
+
+    Parameters:
+        sources (List[str]): Lavalink search prefixes in order of preference, e.g. ytmsearch, ytsearch, scsearch.
+        timeout (float): Seconds a single source may take.
+        hedge_delay (float): Seconds to wait for a source without latency samples before starting the next one, 0 races all of them.
+    """
+    def __init__(self, sources: List[str], timeout: float, hedge_delay: float):
+        self.sources = sources
+        self.timeout = timeout
+        self.hedge_delay = hedge_delay
+        self.stats: dict[str, SourceStats] = {source: SourceStats() for source in [*sources, 'url']}
+        self.logger = logging.getLogger('bot')
+
+    def current_hedge_delay(self, source: str) -> float:
+        """Seconds to give `source` before also asking the next one."""
+        stats = self.stats[source]
+        if self.hedge_delay == 0 or len(stats.latencies) < HEDGE_MIN_SAMPLES:
+            return self.hedge_delay
+        return min(stats.percentile(95) or self.hedge_delay, self.timeout)
+
+    @staticmethod
+    def is_acceptable(result: wavelink.Search) -> bool:
+        return bool(result) and not isinstance(result, wavelink.Playlist)
+
+    async def _search_source(self, source: Optional[str], query: str) -> wavelink.Search:
+        stats = self.stats[source or 'url']
+        loop = asyncio.get_running_loop()
+        started_at = loop.time()
+        try:
+            result = await asyncio.wait_for(wavelink.Playable.search(query, source=source), self.timeout)
+        except asyncio.TimeoutError:
+            stats.timeouts += 1
+            stats.latencies.append(loop.time() - started_at)
+            raise
+        except asyncio.CancelledError:
+            # A loser cancelled once another source answered took at least this long, leaving it out would flatter slow sources
+            stats.latencies.append(loop.time() - started_at)
+            raise
+        except Exception:
+            stats.errors += 1
+            raise
+        stats.latencies.append(loop.time() - started_at)
+        return result
+
+    async def search(self, query: str) -> wavelink.Search:
+        """
+        Returns the tracks found for the query, an empty list if no source found any.
+
+        Raises:
+            asyncio.TimeoutError: Every source timed out.
+        """
+        if yarl.URL(query).host:
+            return await self._search_source(None, query)
+
+        pending: dict[asyncio.Task, str] = {}
+        next_source = 0
+        timed_out = 0
+        hedge_delay = 0.0
+
+        def start_next_source() -> None:
+            nonlocal next_source, hedge_delay
+            source = self.sources[next_source]
+            next_source += 1
+            hedge_delay = self.current_hedge_delay(source)
+            pending[asyncio.create_task(self._search_source(source, query))] = source
+
+        start_next_source()
+        try:
+            while pending:
+                sources_left = next_source < len(self.sources)
+                done, _ = await asyncio.wait(pending, timeout=hedge_delay if sources_left else None, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    start_next_source()
+                    continue
+
+                for task in done:
+                    source = pending.pop(task)
+                    error = task.exception()
+                    if error is None and self.is_acceptable(task.result()):
+                        self.stats[source].wins += 1
+                        # Retrieve the outcome of the other finished searches so asyncio doesn't warn about it
+                        for other in done - {task}:
+                            other.exception()
+                        return task.result()
+                    if isinstance(error, asyncio.TimeoutError):
+                        timed_out += 1
+                    elif error:
+                        self.logger.warning(f'Searching {source} for "{query}" failed: {error}')
+
+                if next_source < len(self.sources):
+                    start_next_source()
+        finally:
+            for task in pending:
+                task.cancel()
+
+        if timed_out == len(self.sources):
+            raise asyncio.TimeoutError(f'Every source timed out searching for "{query}".')
+        return []
@@ -0,0 +1,120 @@
+import asyncio
+import contextvars
+import logging
+from typing import Any, Awaitable, Callable, Optional, TypeVar
+
+T = TypeVar('T')
+
+# The guild whose worker is running the current task, used to run nested calls inline instead of deadlocking
+_current_guild: contextvars.ContextVar[Optional[int]] = contextvars.ContextVar('current_guild', default=None)
+
+class GuildActor:
+    """
+    Serializes operations per guild through a mailbox.
+
+    Every guild with pending work gets a single worker task which runs the operations of that guild one at a time,
+    in the order they were submitted. After each burst (once the mailbox is drained) the coalesced follow-ups
+    registered with `after_burst` run once, no matter how many operations of the burst requested them.
+    Workers are torn down after `idle_timeout` seconds without work and recreated on demand.
+
+    Parameters:
+        idle_timeout (float): Seconds a worker waits for new work before it is torn down.
+    """
+    def __init__(self, idle_timeout: float = 60):
+        self.idle_timeout = idle_timeout
+        self.logger = logging.getLogger('bot')
+        self.mailboxes: dict[int, asyncio.Queue] = {}
+        self.workers: dict[int, asyncio.Task] = {}
+        self.follow_ups: dict[int, dict[str, Callable[[], Awaitable[Any]]]] = {}
+        self.closed = False
+
+    async def run(self, guild_id: int, func: Callable[..., Awaitable[T]], *args: Any, **kwargs: Any) -> T:
+        """
+        Runs `func` in the mailbox of the guild and waits for its result.
+
+        Calls made from inside an operation of the same guild run inline, the worker is busy running the caller.
+        """
+        if _current_guild.get() == guild_id:
+            return await func(*args, **kwargs)
+
+        future: asyncio.Future = asyncio.get_running_loop().create_future()
+        self._mailbox(guild_id).put_nowait((func, args, kwargs, future))
+        return await future
+
+    def after_burst(self, guild_id: int, key: str, func: Callable[[], Awaitable[Any]]) -> None:
+        """
+        Schedules `func` to run once the mailbox of the guild is drained.
+
+        Registering the same `key` again before it ran is a no-op, which merges e.g. every render request
+        of a burst into a single render.
+        """
+        follow_ups = self.follow_ups.setdefault(guild_id, {})
+        if key not in follow_ups:
+            follow_ups[key] = func
+            # Wakes up an idle worker, a busy one runs the follow-up once it drains the mailbox anyway
+            self._mailbox(guild_id).put_nowait(None)
+
+    async def close(self) -> None:
+        self.closed = True
+        for worker in self.workers.values():
+            worker.cancel()
+        await asyncio.gather(*self.workers.values(), return_exceptions=True)
+        self.workers.clear()
+        self.mailboxes.clear()
+        self.follow_ups.clear()
+
+    def _mailbox(self, guild_id: int) -> asyncio.Queue:
+        mailbox = self.mailboxes.setdefault(guild_id, asyncio.Queue())
+        if guild_id not in self.workers:
+            self.workers[guild_id] = asyncio.create_task(self._worker(guild_id, mailbox), name=f'guild-actor-{guild_id}')
+        return mailbox
+
+    async def _worker(self, guild_id: int, mailbox: asyncio.Queue) -> None:
+        _current_guild.set(guild_id)
+        try:
+            while True:
+                if mailbox.empty() and self.follow_ups.get(guild_id):
+                    await self._run_follow_ups(guild_id)
+                    continue
+
+                try:
+                    item = await asyncio.wait_for(mailbox.get(), self.idle_timeout)
+                except asyncio.TimeoutError:
+                    if mailbox.empty() and not self.follow_ups.get(guild_id):
+                        return
+                    continue
+
+                if item is None:
+                    continue
+                func, args, kwargs, future = item
+                if future.cancelled():
+                    continue
+                try:
+                    future.set_result(await func(*args, **kwargs))
+                except asyncio.CancelledError:
+                    future.cancel()
+                    raise
+                except Exception as e:
+                    future.set_exception(e)
+        finally:
+            self.workers.pop(guild_id, None)
+            if self.mailboxes.get(guild_id) is mailbox:
+                del self.mailboxes[guild_id]
+            while not mailbox.empty():
+                item = mailbox.get_nowait()
+                if item is None or item[3].done():
+                    continue
+                if self.closed:
+                    item[3].cancel()
+                else:
+                    self._mailbox(guild_id).put_nowait(item)
+
+    async def _run_follow_ups(self, guild_id: int) -> None:
+        follow_ups = self.follow_ups.pop(guild_id, {})
+        for key, func in follow_ups.items():
+            try:
+                await func()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                self.logger.exception(f'Guild actor follow-up "{key}" failed in the guild(id: {guild_id}).')
@@ -0,0 +1,115 @@
+import asyncio
+import functools
+from collections import Counter, OrderedDict
+from typing import Any, Awaitable, Callable, Optional, TypeVar
+
+import discord
+
+from app.utils.interactions import respond
+from app.utils.ratelimit import TokenBucket
+from app.config import (
+    ADMISSION_USER_RATE, ADMISSION_USER_BURST,
+    ADMISSION_GUILD_RATE, ADMISSION_GUILD_BURST,
+    ADMISSION_GLOBAL_RATE, ADMISSION_GLOBAL_BURST,
+    ADMISSION_MAX_WAIT,
+)
+
+T = TypeVar('T')
+
+class AdmissionController:
+    """
+    Token bucket admission in front of commands, at a per user, per guild and global level.
+
+    A request needs a token from all three buckets. With the 'queue' policy it waits up to `max_wait` seconds
+    for them, with the 'reject' policy (or when the wait would be longer) it is shed right away.
+    Buckets of users and guilds that have not been seen for a while are dropped once there are more than `max_buckets`.
+
+    Parameters:
+        user_rate (float): Requests per second a single user may make.
+        user_burst (float): Requests a single user may make at once.
+        guild_rate (float): Requests per second a single guild may make.
+        guild_burst (float): Requests a single guild may make at once.
+        global_rate (float): Requests per second across every guild.
+        global_burst (float): Requests across every guild at once.
+        max_wait (float): The longest a queued request waits before it is shed.
+        max_buckets (int): The amount of user and guild buckets kept around.
+    """
+    def __init__(self, user_rate: float, user_burst: float, guild_rate: float, guild_burst: float,
+                 global_rate: float, global_burst: float, max_wait: float, max_buckets: int = 10000):
+        self.user_limits = (user_burst, user_rate)
+        self.guild_limits = (guild_burst, guild_rate)
+        self.global_bucket = TokenBucket(capacity=global_burst, rate=global_rate)
+        self.max_wait = max_wait
+        self.max_buckets = max_buckets
+        self.buckets: OrderedDict[tuple[str, int], TokenBucket] = OrderedDict()
+        self.admitted = 0
+        self.queued = 0
+        self.shed: Counter[str] = Counter()
+
+    def _bucket(self, level: str, key: int, limits: tuple[float, float]) -> TokenBucket:
+        bucket = self.buckets.get((level, key))
+        if bucket:
+            self.buckets.move_to_end((level, key))
+            return bucket
+
+        bucket = self.buckets[(level, key)] = TokenBucket(capacity=limits[0], rate=limits[1])
+        if len(self.buckets) > self.max_buckets:
+            self.buckets.popitem(last=False)
+        return bucket
+
+    async def admit(self, user_id: int, guild_id: Optional[int], cost: float = 1.0, policy: str = 'queue') -> bool:
+        """
+        Takes `cost` tokens from the user's, guild's and the global bucket.
+
+        Queued requests reserve their tokens when they arrive and wait for them to refill, so they are admitted
+        in arrival order and a later request can't take the tokens an earlier one is waiting for.
+
+        Returns:
+            bool: False if the request was shed.
+        """
+        levels = [('user', self._bucket('user', user_id, self.user_limits)), ('global', self.global_bucket)]
+        if guild_id is not None:
+            levels.insert(1, ('guild', self._bucket('guild', guild_id, self.guild_limits)))
+
+        # A cost above a bucket's burst could never be paid at once, it takes the whole burst instead
+        costs = [(level, bucket, min(cost, bucket.capacity)) for level, bucket in levels]
+        level, wait = max(((level, bucket.time_until(level_cost)) for level, bucket, level_cost in costs), key=lambda item: item[1])
+        if wait > 0 and (policy == 'reject' or wait > self.max_wait):
+            # Nothing is reserved yet, a shed request doesn't drain the other levels
+            self.shed[level] += 1
+            return False
+
+        for _, bucket, level_cost in costs:
+            bucket.reserve(level_cost)
+        if wait > 0:
+            self.queued += 1
+            await asyncio.sleep(wait)
+        self.admitted += 1
+        return True
+
+admission = AdmissionController(
+        user_rate=ADMISSION_USER_RATE, user_burst=ADMISSION_USER_BURST,
+        guild_rate=ADMISSION_GUILD_RATE, guild_burst=ADMISSION_GUILD_BURST,
+        global_rate=ADMISSION_GLOBAL_RATE, global_burst=ADMISSION_GLOBAL_BURST,
+        max_wait=ADMISSION_MAX_WAIT,
+        )
+
+def admitted(cost: float = 1.0, policy: str = 'queue') -> Callable[[Callable[..., Awaitable[T]]], Callable[..., Awaitable[Optional[T]]]]:
+    """
+    Decorator running the callback only if the admission controller lets the interaction through,
+    otherwise the user is told to slow down. Goes below `deferred()` so the interaction is acknowledged while queued.
+
+    Parameters:
+        cost (float): The amount of tokens the callback takes, e.g. more for callbacks which search.
+        policy (str): 'queue' to wait for tokens, 'reject' to shed the interaction right away if there are none.
+    """
+    def decorator(func: Callable[..., Awaitable[T]]) -> Callable[..., Awaitable[Optional[T]]]:
+        @functools.wraps(func)
+        async def wrapper(*args: Any, **kwargs: Any) -> Optional[T]:
+            interaction = next(arg for arg in args if isinstance(arg, discord.Interaction))
+            if not await admission.admit(interaction.user.id, interaction.guild_id, cost=cost, policy=policy):
+                await respond(interaction, 'The bot is busy or you are going too fast, try again in a few seconds.')
+                return None
+            return await func(*args, **kwargs)
+        return wrapper
+    return decorator
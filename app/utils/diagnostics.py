@@ -0,0 +1,100 @@
+import asyncio
+import io
+import os
+import sys
+import time
+from collections import Counter, deque
+from typing import List, Optional
+
+class LoopLagMonitor:
+    """
+    Measures how late the event loop wakes up a task sleeping for `interval` seconds.
+    A lag close to 0 means the loop is free, a high lag means something blocked it for that long.
+
+    Parameters:
+        interval (float): Seconds between two measurements.
+        max_samples (int): The amount of measurements kept, by default the last 10 minutes.
+    """
+    def __init__(self, interval: float = 0.5, max_samples: int = 1200):
+        self.interval = interval
+        self.samples: deque[float] = deque(maxlen=max_samples)
+        self.task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        if not self.task:
+            self.task = asyncio.create_task(self._run(), name='loop-lag-monitor')
+
+    def stop(self) -> None:
+        if self.task:
+            self.task.cancel()
+            self.task = None
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            self.samples.append(max(0.0, loop.time() - expected))
+
+    def percentile(self, percentile: float) -> Optional[float]:
+        if not self.samples:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * percentile / 100))]
+
+def dump_tasks() -> str:
+    """Returns the name, coroutine and stack of every running asyncio task."""
+    buffer = io.StringIO()
+    tasks = sorted(asyncio.all_tasks(), key=lambda task: task.get_name())
+    buffer.write(f'{len(tasks)} tasks\n\n')
+    for task in tasks:
+        buffer.write(f'=== {task.get_name()}: {task.get_coro()!r}\n')
+        task.print_stack(file=buffer)
+        buffer.write('\n')
+    return buffer.getvalue()
+
+class LoopProfiler:
+    """
+    Samples the stack of the thread running the event loop from another thread.
+
+    The result is written in the collapsed stack format ("frame;frame;frame count" per line),
+    which flamegraph.pl and speedscope read directly.
+
+    Parameters:
+        thread_id (int): The id of the thread to sample, the one running the event loop.
+        interval (float): Seconds between two samples.
+    """
+    def __init__(self, thread_id: int, interval: float = 0.005):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks: Counter[str] = Counter()
+        self.samples = 0
+
+    @staticmethod
+    def _format_frame(frame) -> str:
+        code = frame.f_code
+        return f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})'
+
+    def run(self, duration: float) -> None:
+        """Samples for `duration` seconds, blocking. Meant to run in a worker thread."""
+        deadline = time.monotonic() + duration
+        while time.monotonic() < deadline:
+            frame = sys._current_frames().get(self.thread_id)
+            frames: List[str] = []
+            while frame:
+                frames.append(self._format_frame(frame))
+                frame = frame.f_back
+            if frames:
+                self.stacks[';'.join(reversed(frames))] += 1
+                self.samples += 1
+            time.sleep(self.interval)
+
+    def collapsed(self) -> str:
+        return ''.join(f'{stack} {count}\n' for stack, count in self.stacks.most_common())
+
+    def top_frames(self, amount: int = 10) -> List[tuple[str, int]]:
+        """The frames the loop spent the most samples in, ignoring what they called."""
+        leaves: Counter[str] = Counter()
+        for stack, count in self.stacks.items():
+            leaves[stack.rsplit(';', 1)[-1]] += count
+        return leaves.most_common(amount)
@@ -0,0 +1,133 @@
+import json
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Callable, List, Optional
+
+import discord
+
+# Rough per-object overheads used by the size estimate, the exact numbers matter less than being consistent
+MESSAGE_OVERHEAD = 4096
+VIEW_ITEM_OVERHEAD = 1024
+
+class GuildState:
+    """
+    In-memory state kept for a guild. Everything in here can be rebuilt from the database and Discord,
+    so it can be dropped at any time.
+    """
+    def __init__(self, guild_id: int):
+        self.guild_id = guild_id
+        self.last_active = time.monotonic()
+        self.player_message: Optional[discord.Message] = None
+        self.embeds: Optional[List[discord.Embed]] = None
+        self.view: Optional[discord.ui.View] = None
+        self.signature: Optional[Any] = None
+        self.size = 0
+
+    def estimate_size(self) -> int:
+        size = 0
+        if self.player_message:
+            size += MESSAGE_OVERHEAD
+        if self.embeds:
+            size += sum(len(json.dumps(embed.to_dict())) for embed in self.embeds)
+        if self.view:
+            size += VIEW_ITEM_OVERHEAD * len(self.view.children)
+        return size
+
+    def release(self) -> None:
+        # Stopping the view removes it from discord.py's view store, its buttons are rehydrated on the next click
+        if self.view:
+            self.view.stop()
+        self.player_message = None
+        self.embeds = None
+        self.view = None
+        self.signature = None
+        self.size = 0
+
+class GuildStateCache:
+    """
+    LRU cache of GuildState objects with a memory budget.
+
+    Guilds are evicted least recently used first once the estimated size of all states exceeds `budget`,
+    and by `sweep` once they have been idle for longer than `idle_timeout` seconds.
+
+    Parameters:
+        budget (int): The estimated amount of bytes all states may take up together.
+        idle_timeout (float): Seconds without activity after which a guild is evicted by `sweep`.
+        on_evict (Optional[Callable[[GuildState], None]]): Called with every evicted state.
+    """
+    def __init__(self, budget: int, idle_timeout: float, on_evict: Optional[Callable[[GuildState], None]] = None):
+        self.budget = budget
+        self.idle_timeout = idle_timeout
+        self.on_evict = on_evict
+        self.states: OrderedDict[int, GuildState] = OrderedDict()
+        self.total_size = 0
+        self.evictions = 0
+        self.logger = logging.getLogger('bot')
+
+    def __contains__(self, guild_id: int) -> bool:
+        return guild_id in self.states
+
+    def __len__(self) -> int:
+        return len(self.states)
+
+    def get(self, guild_id: int) -> Optional[GuildState]:
+        state = self.states.get(guild_id)
+        if state:
+            self.touch(guild_id)
+        return state
+
+    def get_or_create(self, guild_id: int) -> GuildState:
+        state = self.get(guild_id)
+        if not state:
+            state = self.states[guild_id] = GuildState(guild_id)
+        return state
+
+    def touch(self, guild_id: int) -> None:
+        state = self.states.get(guild_id)
+        if state:
+            state.last_active = time.monotonic()
+            self.states.move_to_end(guild_id)
+
+    def resize(self, guild_id: int) -> None:
+        """Re-estimates the size of the guild's state after it changed and evicts other guilds if over budget."""
+        state = self.states.get(guild_id)
+        if not state:
+            return
+        new_size = state.estimate_size()
+        self.total_size += new_size - state.size
+        state.size = new_size
+
+        while self.total_size > self.budget and len(self.states) > 1:
+            oldest_guild_id = next(iter(self.states))
+            if oldest_guild_id == guild_id:
+                break
+            self.evict(oldest_guild_id)
+
+    def evict(self, guild_id: int) -> None:
+        state = self.states.pop(guild_id, None)
+        if not state:
+            return
+        self.total_size -= state.size
+        self.evictions += 1
+        state.release()
+        if self.on_evict:
+            self.on_evict(state)
+
+    def sweep(self) -> int:
+        """Evicts every guild idle for longer than `idle_timeout`, returns the amount of evicted guilds."""
+        deadline = time.monotonic() - self.idle_timeout
+        idle_guild_ids = []
+        # States are ordered by last activity, so the idle ones are all at the front
+        for guild_id, state in self.states.items():
+            if state.last_active > deadline:
+                break
+            idle_guild_ids.append(guild_id)
+
+        for guild_id in idle_guild_ids:
+            self.evict(guild_id)
+        return len(idle_guild_ids)
+
+    def clear(self) -> None:
+        for guild_id in list(self.states):
+            self.evict(guild_id)
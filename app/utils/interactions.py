@@ -0,0 +1,98 @@
+import functools
+import logging
+from collections import deque
+from typing import Any, Awaitable, Callable, Optional, TypeVar
+
+import discord
+
+T = TypeVar('T')
+
+# Discord drops interactions which are not acknowledged within 3 seconds of being created
+ACK_DEADLINE = 3.0
+
+class AckStats:
+    """
+    Keeps the latest acknowledgement latencies, measured from the creation of the interaction on Discord's side
+    until our defer went through, and counts the interactions which missed the deadline.
+    """
+    def __init__(self, max_samples: int = 1000):
+        self.samples: deque[float] = deque(maxlen=max_samples)
+        self.acked = 0
+        self.missed = 0
+
+    def record(self, latency: float) -> None:
+        self.samples.append(latency)
+        self.acked += 1
+        if latency > ACK_DEADLINE:
+            self.missed += 1
+
+    def record_miss(self) -> None:
+        self.missed += 1
+
+    def percentile(self, percentile: float) -> Optional[float]:
+        if not self.samples:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * percentile / 100))]
+
+ack_stats = AckStats()
+
+def _find_interaction(args: tuple) -> discord.Interaction:
+    for arg in args:
+        if isinstance(arg, discord.Interaction):
+            return arg
+    raise TypeError('deferred() callbacks need a discord.Interaction argument.')
+
+async def defer(interaction: discord.Interaction, thinking: bool = True, ephemeral: bool = True) -> bool:
+    """
+    Acknowledges the interaction right away and records how long it took.
+
+    Parameters:
+        interaction (discord.Interaction): The interaction to acknowledge.
+        thinking (bool): Whether to show the "thinking..." response which is later edited, otherwise the click is acknowledged silently.
+        ephemeral (bool): Whether the response is only visible to the user.
+
+    Returns:
+        bool: False if the interaction expired before it could be acknowledged.
+    """
+    if interaction.response.is_done():
+        return True
+
+    try:
+        await interaction.response.defer(ephemeral=ephemeral, thinking=thinking)
+    except discord.NotFound:
+        ack_stats.record_miss()
+        logging.getLogger('bot').warning(f'Interaction(id: {interaction.id}) expired before it could be acknowledged.')
+        return False
+
+    latency = (discord.utils.utcnow() - interaction.created_at).total_seconds()
+    ack_stats.record(latency)
+    if latency > ACK_DEADLINE:
+        logging.getLogger('bot').warning(f'Acknowledging interaction(id: {interaction.id}) took {latency:.2f}s.')
+    return True
+
+def deferred(thinking: bool = True, ephemeral: bool = True) -> Callable[[Callable[..., Awaitable[T]]], Callable[..., Awaitable[Optional[T]]]]:
+    """
+    Decorator for slash commands and component callbacks which acknowledges the interaction before running the callback,
+    so slow work such as voice connects or Lavalink searches can never run into Discord's deadline.
+    The callback then responds with `interaction.edit_original_response` or followups.
+
+    Parameters:
+        thinking (bool): Whether to show the "thinking..." response which is later edited, otherwise the click is acknowledged silently.
+        ephemeral (bool): Whether the response is only visible to the user.
+    """
+    def decorator(func: Callable[..., Awaitable[T]]) -> Callable[..., Awaitable[Optional[T]]]:
+        @functools.wraps(func)
+        async def wrapper(*args: Any, **kwargs: Any) -> Optional[T]:
+            if not await defer(_find_interaction(args), thinking=thinking, ephemeral=ephemeral):
+                return None
+            return await func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+async def respond(interaction: discord.Interaction, content: str) -> None:
+    """Responds to the interaction, editing the response if it was already acknowledged."""
+    if interaction.response.is_done():
+        await interaction.edit_original_response(content=content)
+    else:
+        await interaction.response.send_message(content, ephemeral=True)
@@ -0,0 +1,100 @@
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, TypeVar
+
+import discord
+
+T = TypeVar('T')
+
+class TokenBucket:
+    """
+    A token bucket holding up to `capacity` tokens, refilled at `rate` tokens per second.
+
+    Parameters:
+        capacity (float): The maximum amount of tokens the bucket can hold, i.e. the allowed burst.
+        rate (float): The amount of tokens added to the bucket every second.
+    """
+    def __init__(self, capacity: float, rate: float):
+        self.capacity = capacity
+        self.rate = rate
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def try_acquire(self, tokens: float = 1.0) -> bool:
+        self._refill()
+        if self.tokens >= tokens:
+            self.tokens -= tokens
+            return True
+        return False
+
+    def time_until(self, tokens: float = 1.0) -> float:
+        """Returns the amount of seconds until `tokens` tokens are available, 0 if they already are."""
+        self._refill()
+        if self.tokens >= tokens:
+            return 0.0
+        return (tokens - self.tokens) / self.rate
+
+    def reserve(self, tokens: float = 1.0) -> float:
+        """
+        Takes `tokens` tokens even if the bucket goes negative, later callers then wait for the debt to be refilled first.
+
+        Returns:
+            float: The amount of seconds until the reserved tokens are actually available, 0 if they already are.
+        """
+        wait = self.time_until(tokens)
+        self.tokens -= tokens
+        return wait
+
+    async def acquire(self, tokens: float = 1.0) -> None:
+        while not self.try_acquire(tokens):
+            await asyncio.sleep(self.time_until(tokens))
+
+class BucketExecutor:
+    """
+    Runs Discord API calls through a token bucket with a bounded amount of requests in flight.
+
+    When Discord answers with a 429 the whole executor backs off for the advertised `retry_after`
+    before the call is retried, so a single rate limited request pauses every other queued one too.
+
+    Parameters:
+        rate (float): The sustained amount of requests per second.
+        concurrency (int): The maximum amount of requests in flight at once.
+        max_retries (int): How many times a rate limited call is retried before the error is raised.
+    """
+    def __init__(self, rate: float, concurrency: int, max_retries: int = 3):
+        self.bucket = TokenBucket(capacity=max(1.0, float(concurrency)), rate=rate)
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.max_retries = max_retries
+        self.paused_until = 0.0
+        self.logger = logging.getLogger('bot')
+
+    async def run(self, func: Callable[..., Awaitable[T]], *args: Any, **kwargs: Any) -> T:
+        attempt = 0
+        async with self.semaphore:
+            while True:
+                delay = self.paused_until - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                await self.bucket.acquire()
+
+                try:
+                    return await func(*args, **kwargs)
+                except discord.RateLimited as e:
+                    retry_after: float = e.retry_after
+                except discord.HTTPException as e:
+                    if e.status != 429 or not e.response:
+                        raise
+                    retry_after = float(e.response.headers.get('Retry-After', 1))
+
+                attempt += 1
+                if attempt > self.max_retries:
+                    raise RuntimeError(f'Gave up after being rate limited {self.max_retries} times.')
+
+                self.logger.warning(f'Rate limited by Discord, backing off for {retry_after:.2f}s (attempt {attempt}/{self.max_retries}).')
+                self.paused_until = max(self.paused_until, time.monotonic() + retry_after)
@@ -0,0 +1,50 @@
+import logging
+import time
+from contextlib import contextmanager
+from typing import Iterator, List, Optional
+
+class StartupReport:
+    """
+    Collects how long the bot takes to start: how long the timed imports took and when the milestones
+    (gateway ready, cogs loaded, first command served...) were reached, relative to the start of the process.
+    Kept free of heavy imports, it is used before anything else is loaded.
+    """
+    def __init__(self):
+        self.started_at = time.perf_counter()
+        self.timings: List[tuple[str, float]] = []
+        self.milestones: dict[str, float] = {}
+        self.reported = False
+
+    def restart_clock(self, started_at: float) -> None:
+        """Counts from `started_at` instead, e.g. a timestamp taken at the very top of the entry point."""
+        self.started_at = started_at
+
+    @contextmanager
+    def timed(self, label: str) -> Iterator[None]:
+        started_at = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings.append((label, time.perf_counter() - started_at))
+
+    def mark(self, milestone: str) -> Optional[float]:
+        """Records the first time `milestone` is reached, returns the seconds since the start if it was the first time."""
+        if milestone in self.milestones:
+            return None
+        self.milestones[milestone] = time.perf_counter() - self.started_at
+        return self.milestones[milestone]
+
+    def format(self) -> str:
+        lines = ['Startup report:']
+        for label, seconds in self.timings:
+            lines.append(f'  {label}: {seconds * 1000:.0f}ms')
+        for milestone, seconds in sorted(self.milestones.items(), key=lambda item: item[1]):
+            lines.append(f'  {milestone} after {seconds:.2f}s')
+        return '\n'.join(lines)
+
+    def log(self) -> None:
+        if not self.reported:
+            self.reported = True
+            logging.getLogger('bot').info(self.format())
+
+startup = StartupReport()
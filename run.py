@@ -1,3 +1,34 @@
+import time
+
+started_at = time.perf_counter()
+
+import argparse
+import sys
+
+def check() -> int:
+    """Validates the config without importing discord, wavelink or SQLAlchemy, returns the exit code."""
+    from app.config import check_config
+
+    problems = check_config()
+    for problem in problems:
+        print(f'Config error: {problem}')
+    heavy_modules = [module for module in ('discord', 'wavelink', 'sqlalchemy') if module in sys.modules]
+    if heavy_modules:
+        print(f'Warning: the check imported {", ".join(heavy_modules)}')
+    if not problems:
+        print(f'Config OK, checked in {(time.perf_counter() - started_at) * 1000:.0f}ms')
+    return 1 if problems else 0
+
 if __name__ == '__main__':
-    from app import main
+    parser = argparse.ArgumentParser(description='Runs the bot.')
+    parser.add_argument('--check', action='store_true', help='Only validate the config and exit, non-zero if it is invalid.')
+    args = parser.parse_args()
+
+    if args.check:
+        sys.exit(check())
+
+    from app.utils.startup import startup
+    startup.restart_clock(started_at)
+    with startup.timed('import app.main'):
+        from app import main
     main.main(debug=True)